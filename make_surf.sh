@@ -8,7 +8,8 @@ COMMON_FILES="bf.py \
 	      dev_submod.py \
 	      wbspi.py \
 	      serialcobsdevice.py \
-	      pueo_utils.py"
+	      pueo_utils.py \
+	      aligncache.py"
 
 if [ "$#" -ne 1 ] ; then
     echo "usage: make_surf.sh <destination directory>"
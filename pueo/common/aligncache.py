@@ -0,0 +1,116 @@
+import os
+import json
+
+from . import pueo_utils
+
+# Alignment cache.
+#
+# Every bring-up re-derives every eye (RXCLK phases, CIN/COUT/DOUT
+# eyes, TURF-side TURFIO bits). They don't really move between power
+# cycles, so they're stored on disk keyed by the board doing the
+# aligning (DNA and firmware DateVersion), the link and the slot:
+#
+# >>> cache = AlignCache()
+# >>> board = cache.board(tio)
+# >>> keys = [ cache.key(board, 'dout', sn) for sn in range(7) ]
+# >>> rescan = cache.warm(keys, lambda n, eye : tio.dalign[n].try_alignment(eye))
+# >>> for n in rescan:
+# ...     (full scan, apply, then cache.put(keys[n], eye))
+# >>> cache.save()
+#
+# warm() applies each cached value (the apply function checks bit
+# errors/training capture once and says whether it worked) and hands
+# back only the ones that need a full scan: no cache entry, or the
+# cached one failed verification (which also drops it). If warm ones
+# turn out to be unusable after all (e.g. they don't match what the
+# scanned ones found), invalidate() drops them and counts them as
+# scanned. cold=True ignores what's on disk, but still saves what gets
+# found.
+ALIGN_CACHE = os.path.join(os.path.dirname(pueo_utils.DNA_CACHE), 'align.json')
+
+class AlignCache:
+    def __init__(self, path=None, cold=False):
+        self.path = ALIGN_CACHE if path is None else path
+        self.cold = cold
+        self.entries = {} if cold else self.load(self.path)
+        self.dropped = set()
+        # keys warm() applied successfully
+        self.warmed = set()
+        self.nwarm = 0
+        self.nscan = 0
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self):
+        # merge with whatever's there now, someone else might've been aligning
+        d = self.load(self.path)
+        for key in self.dropped:
+            d.pop(key, None)
+        d.update(self.entries)
+        # it's just a cache, if we can't write it, whatever
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.%d' % os.getpid()
+            with open(tmp, 'w') as f:
+                json.dump(d, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def board(dev):
+        """ the part of the key for the board: DNA and firmware DateVersion """
+        return '%15.15x@%8.8x' % (dev.dna(), dev.read(dev.map['FPGA_DATEVERSION']))
+
+    @staticmethod
+    def key(board, link, slot=None):
+        if slot is None:
+            return f'{board}/{link}'
+        return f'{board}/{link}{slot}'
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.dropped.discard(key)
+
+    def _drop(self, key):
+        self.entries.pop(key, None)
+        self.dropped.add(key)
+
+    def invalidate(self, keys):
+        """ Drop keys that warm() applied: they get rescanned instead. """
+        for key in keys:
+            if key in self.warmed:
+                self.warmed.discard(key)
+                self.nwarm -= 1
+                self.nscan += 1
+            self._drop(key)
+
+    def warm(self, keys, apply, verbose=True):
+        """
+        Apply the cached values for keys. apply(n, value) applies the value
+        for keys[n], checks it and returns True if it's good. Returns the
+        indices that need a full scan.
+        """
+        rescan = []
+        for n, key in enumerate(keys):
+            v = self.get(key)
+            if v is not None and apply(n, v):
+                self.nwarm += 1
+                self.warmed.add(key)
+                continue
+            if v is not None:
+                if verbose:
+                    print(f'{key}: cached alignment {v} failed verification, rescanning')
+                self._drop(key)
+            rescan.append(n)
+        self.nscan += len(rescan)
+        return rescan
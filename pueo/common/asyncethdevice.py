@@ -0,0 +1,199 @@
+import asyncio
+import struct
+import ipaddress
+
+from .dev_submod import regfields
+
+# asyncio version of EthDevice. Everything here is a coroutine, so
+# one event loop can keep many TURFIOs/SURFs busy at once:
+#
+# >>> dev = AsyncEthDevice()
+# >>> await dev.connect()
+# >>> crate = PueoCrateBridge(dev, (1<<27))
+# >>> ids = await asyncio.gather(*[ l.read(0) for l in crate.link ])
+#
+# dev_submod just passes through whatever its device returns, so
+# any dev_submod built on top of this has awaitable read/write/
+# readmany/writemany/readblock/writeblock for free. The register
+# properties (bitfield etc.) do arithmetic on the read, so they
+# don't work directly: use aget/aset/asnapshot below instead, which
+# work from the same register metadata:
+#
+# >>> tio = PueoTURFIF(dev, 0x14000)
+# >>> bits = await asyncio.gather(*[ asnapshot(b) for b in tio.bit ])
+# >>> await aset(tio.bit[0], 'enable', 1)
+#
+# The higher-level PueoTURF/PueoTURFIO/PueoSURF methods (alignment,
+# programming, etc.) are still synchronous only.
+#
+# Replies are demultiplexed by tag, so they can come back in any
+# order. Each request has a timeout: a lost reply fails its future
+# with IOError and frees its tag and window slot. A reply that shows
+# up after that is dropped (every reply echoes the request's address
+# word, so it won't be mistaken for a newer request that reused the
+# tag). Unlike EthDevice the local port defaults to 0 (any free port)
+# so this can run next to a normal EthDevice: the TURF responds to
+# whatever port sent it data.
+class AsyncEthDevice(asyncio.DatagramProtocol):
+    DAQ_IP = "10.68.65.81"
+
+    # same deal as EthDevice: 4 bit tag, keep one free
+    MAX_OUTSTANDING = 15
+
+    def __init__(self,
+                 remote_ip = None,
+                 remote_rp = 21618,
+                 remote_wp = 21623,
+                 local_ip = "10.68.65.1",
+                 local_port = 0,
+                 timeout = 1.0):
+        if remote_ip is None:
+            remote_ip = self.DAQ_IP
+        self.remote_ip = ipaddress.ip_address(remote_ip)
+        self.remote_readport = remote_rp
+        self.remote_writeport = remote_wp
+        self.local_ip = ipaddress.ip_address(local_ip)
+        self.local_port = local_port
+        self.timeout = timeout
+        self._raddr = (str(self.remote_ip), self.remote_readport)
+        self._waddr = (str(self.remote_ip), self.remote_writeport)
+
+        self.transport = None
+        self.window = None
+        self.tag = 1
+        # in flight, by tag: (future, is write, address word, timeout handle)
+        self.pending = {}
+        # late replies that got dropped
+        self.stale = 0
+
+    async def connect(self):
+        """ Open the socket and read the ID register with tag 0. """
+        loop = asyncio.get_running_loop()
+        self.window = asyncio.Semaphore(self.MAX_OUTSTANDING)
+        await loop.create_datagram_endpoint(lambda : self,
+                                            local_addr=(str(self.local_ip),
+                                                        self.local_port))
+        id = await self._submit(0, None, tag=0)
+        print("Connected to device: ", id.to_bytes(4, 'big').decode())
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    # asyncio.DatagramProtocol callbacks
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        resp = data[::-1]
+        tag = (resp[4] >> 4)
+        entry = self.pending.get(tag)
+        if entry is None or entry[2] != struct.unpack(">I", resp[4:8])[0]:
+            # late reply to something that already timed out
+            self.stale += 1
+            return
+        del self.pending[tag]
+        fut, write, addr, handle = entry
+        handle.cancel()
+        if not fut.done():
+            fut.set_result(4 if write else struct.unpack(">I", resp[0:4])[0])
+
+    def _timeout(self, tag, fut):
+        entry = self.pending.get(tag)
+        if entry is not None and entry[0] is fut:
+            del self.pending[tag]
+            if not fut.done():
+                fut.set_exception(IOError("Timed out waiting for tag %d (address %#x)" %
+                                          (tag, entry[2] & 0xFFFFFFF)))
+
+    def _fail_all(self, exc):
+        for fut, write, addr, handle in self.pending.values():
+            handle.cancel()
+            if not fut.done():
+                fut.set_exception(exc)
+        self.pending.clear()
+
+    def error_received(self, exc):
+        # fail everyone, there's no way to know who this was for
+        self._fail_all(exc)
+
+    def connection_lost(self, exc):
+        self._fail_all(exc or IOError("connection closed"))
+
+    def _submit(self, addr, value, tag=None):
+        # The window guarantees a free tag exists, but replies can come
+        # back out of order so the next one in line might still be busy.
+        if tag is None:
+            tag = self.tag
+            while tag in self.pending:
+                tag = (tag + 1) & 0xF
+            self.tag = (tag + 1) & 0xF
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        addr = (addr & 0xFFFFFFF) | (tag << 28)
+        handle = loop.call_later(self.timeout, self._timeout, tag, fut)
+        self.pending[tag] = (fut, value is not None, addr, handle)
+        if value is None:
+            self.transport.sendto(addr.to_bytes(4, 'little'), self._raddr)
+        else:
+            self.transport.sendto(addr.to_bytes(4, 'little') + value.to_bytes(4, 'little'),
+                                  self._waddr)
+        return fut
+
+    async def read(self, addr):
+        async with self.window:
+            return await self._submit(addr, None)
+
+    async def write(self, addr, value):
+        async with self.window:
+            return await self._submit(addr, value)
+
+    # Tasks get the window in the order they were created, so these
+    # go out on the wire in order (which matters for things like DNA).
+    async def readmany(self, addrs):
+        return list(await asyncio.gather(*[ self.read(addr) for addr in addrs ]))
+
+    async def writemany(self, addrs, values):
+        r = await asyncio.gather(*[ self.write(addr, value) for addr, value in zip(addrs, values) ])
+        return sum(r)
+
+    async def readblock(self, base, n, stride=4):
+        import numpy as np
+        return np.array(await self.readmany(range(base, base+n*stride, stride)),
+                        dtype=np.uint32)
+
+    async def writeblock(self, base, data, stride=4):
+        data = [ int(v) for v in data ]
+        return await self.writemany(range(base, base+len(data)*stride, stride), data)
+
+# Register access by name for anything built on an AsyncEthDevice,
+# from the same metadata the (synchronous) properties use.
+async def aget(dev, name):
+    """ await the value of register field name on dev """
+    f = regfields(type(dev))[name]
+    return f.decode(await dev.read(f.address))
+
+async def aset(dev, name, value):
+    """ set register field name on dev (read-modify-write unless it's a whole register) """
+    f = regfields(type(dev))[name]
+    if f.readonly:
+        raise AttributeError("%s is read-only" % name)
+    if f.conversion is not None:
+        value = f.conversion(value, False)
+    value = int(value)
+    if f.start == 0 and f.mask == 0xFFFFFFFF:
+        return await dev.write(f.address, value & 0xFFFFFFFF)
+    r = await dev.read(f.address)
+    r = (r & ~(f.mask << f.start)) | ((value & f.mask) << f.start)
+    return await dev.write(f.address, r)
+
+async def asnapshot(dev, fields=None):
+    """ await every register field of dev (or the named ones), each address read once """
+    allf = regfields(type(dev))
+    if fields is not None:
+        allf = { name : allf[name] for name in fields }
+    addrs = sorted(set(f.address for f in allf.values()))
+    words = dict(zip(addrs, await dev.readmany(addrs)))
+    return { name : f.decode(words[f.address]) for name, f in allf.items() }
@@ -55,3 +55,55 @@ class bf(object):
 
     def __index__(self):
         return self._d
+
+# bf allocates an object for every read-modify-write and works out
+# the mask on every slice. For hot paths, make a field once:
+#
+# >>> DATA_OUT = field(23, 16)
+# >>> DATA_OUT.get(0x00AB0000)
+# 171
+# >>> hex(DATA_OUT.set(0xFFFFFFFF, 0))
+# '0xff00ffff'
+#
+# and everything after that is plain int ops on plain ints. Like bf,
+# the bit order can be either way, field(16, 23) is the same thing.
+class field:
+    __slots__ = ('lo', 'mask', 'smask', 'nsmask')
+
+    def __init__(self, hi, lo=None):
+        if lo is None:
+            lo = hi
+        if lo > hi:
+            hi, lo = lo, hi
+        self.lo = lo
+        self.mask = (1 << (hi - lo + 1)) - 1
+        self.smask = self.mask << lo
+        self.nsmask = ~self.smask
+
+    def get(self, v):
+        return (v >> self.lo) & self.mask
+
+    def set(self, v, value):
+        """ returns v with this field replaced by value """
+        return (v & self.nsmask) | ((value & self.mask) << self.lo)
+
+    def __repr__(self):
+        return f'field({self.lo + self.mask.bit_length() - 1}, {self.lo})'
+
+# Same thing, for numpy.uint32 arrays (e.g. a block read or a log of
+# register values): get/set work on the whole array at once.
+class npfield(field):
+    __slots__ = ('_lo', '_mask', '_nsmask')
+
+    def __init__(self, hi, lo=None):
+        import numpy as np
+        super().__init__(hi, lo)
+        self._lo = np.uint32(self.lo)
+        self._mask = np.uint32(self.mask)
+        self._nsmask = np.uint32(self.nsmask & 0xFFFFFFFF)
+
+    def get(self, v):
+        return (v >> self._lo) & self._mask
+
+    def set(self, v, value):
+        return (v & self._nsmask) | ((value & self._mask) << self._lo)
@@ -3,6 +3,42 @@
 # There's probably some simpler way to do this. I have no idea.
 # This entire file should probably be named something else.
 
+from contextlib import contextmanager
+import time
+
+class regfield(property):
+    """
+    The property made by bitfield/bitfield_ro/register/register_ro. It's
+    a normal property, but it remembers what it describes, and registers
+    itself in its class's _regmap so the register map can be looked at
+    (see regfields() and snapshot()).
+    """
+    def __init__(self, fget, fset, doc, address, start, mask, signed, readonly, conversion):
+        super().__init__(fget=fget, fset=fset, doc=doc)
+        # the class docstring would shadow it otherwise
+        self.__doc__ = doc
+        self.address = address
+        self.start = start
+        self.mask = mask
+        self.signed = signed
+        self.readonly = readonly
+        self.conversion = conversion
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        if '_regmap' not in vars(owner):
+            owner._regmap = {}
+        owner._regmap[name] = self
+
+    def decode(self, word):
+        """ Pull this field out of a register value """
+        twid = ((self.mask+1)>>1)*int(self.signed)
+        v = (((word >> self.start) & self.mask) ^ twid) - twid
+        if self.conversion is not None:
+            return self.conversion(v, True)
+        return v
+
 # property helper
 def _property_base(address, bf_params, doc="", signed=False, conversion=None, readonly=False):
     """
@@ -26,18 +62,16 @@ def _property_base(address, bf_params, doc="", signed=False, conversion=None, re
         twid = ((mask+1)>>1)*int(signed)        
         if conversion is None:
             fget = lambda self : (((self.read(address) >> start) & mask) ^ twid) - twid
-            fset = lambda self, v : (self.write(address, (self.read(address) & (~(mask<<start))) | ((int(v)&mask)<<start)))
+            fset = lambda self, v : shadow_rmw(self, address, start, mask, int(v))
         else:
             fget = lambda self : conversion((((self.read(address) >> start) & mask) ^ twid) - twid, True)
-            fset = lambda self, v : (self.write(address, (self.read(address) & (~(mask<<start))) | ((conversion(v,False)&mask) << start)))
+            fset = lambda self, v : shadow_rmw(self, address, start, mask, conversion(v,False))
 
-    if readonly:
-        return property(fget=fget,
-                        doc=doc)
-    else:
-        return property(fget=fget,
-                        fset=fset,
-                        doc=doc)
+    if bf_params is None:
+        bf_params = (0, 0xFFFFFFFF)
+    return regfield(fget, None if readonly else fset, doc,
+                    address, bf_params[0], bf_params[1],
+                    signed, readonly, conversion)
     
 
 def bitfield(address, start, mask, doc="", signed=False, conversion=None):
@@ -56,18 +90,481 @@ def register_ro(address, doc="", signed=False, conversion=None):
     """ Read only register property: a 32-bit value at 'address' """
     return _property_base(address, None, doc, signed, conversion, readonly=True)
 
+# Figure out where an access to 'dev' really ends up: returns the
+# object that actually does the access and the offset to add. Anything
+# with a _resolve() method can be seen through (dev_submods always can,
+# PueoTURFIO/PueoSURF can if they're going through a bridge), anything
+# else is a root.
+def _resolve_root(dev):
+    r = getattr(dev, '_resolve', None)
+    if r is None:
+        return (dev, 0)
+    return r()
+
+# Batches across several devices: everything that resolves to the same
+# root goes out as one readmany/writemany (e.g. the same register in
+# every aligner of a TURFIO, or in every TURFIO bit on the TURF).
+def _group(accesses):
+    groups = {}
+    for i, acc in enumerate(accesses):
+        root, offset = _resolve_root(acc[0])
+        g = groups.get(id(root))
+        if g is None:
+            g = (root, [])
+            groups[id(root)] = g
+        g[1].append((i, acc[1] + offset) + tuple(acc[2:]))
+    return groups.values()
+
+def readmany_multi(accesses):
+    """ accesses is a list of (dev, addr). Returns the values, in the same order. """
+    rv = [ None ]*len(accesses)
+    for root, ops in _group(accesses):
+        for op, val in zip(ops, root.readmany([ op[1] for op in ops ])):
+            rv[op[0]] = val
+    return rv
+
+def writemany_multi(accesses):
+    """ accesses is a list of (dev, addr, value) """
+    for root, ops in _group(accesses):
+        root.writemany([ op[1] for op in ops ], [ op[2] for op in ops ])
+
+# Shadow register cache.
+#
+# Bitfield setters are read-modify-write, so each one costs a read AND
+# a write. For control registers the read is pointless: we know what we
+# wrote. A class lists its control registers along with the mask of the
+# bits that just hold whatever was written:
+#
+#    shadow = { 0x000 : 0x00000414 }
+#
+# and the bits that are status or self-clearing flags/strobes, which
+# are never written back (always written as 0):
+#
+#    shadow_flags = { 0x000 : 0xFFFFFBEB }
+#
+# Setters only skip the read if those two masks cover the WHOLE
+# register. Anything else might be a bit that has to be written back as
+# it reads right now, so those registers still get a live
+# read-modify-write (with the flags cleared). The shadow lives on the
+# root transport, keyed by absolute address, so everything that sees
+# the same register shares it.
+#
+# Writes to a shadowed register that don't go through shadow_rmw must
+# use shadow_write, and anything that resets the hardware underneath
+# has to call shadow_invalidate. Transports that other processes also
+# write through (the broker) set NO_SHADOW and never get a cache.
+class ShadowCache:
+    def __init__(self):
+        # absolute address -> control bit mask (fully described registers only)
+        self.ctrl = {}
+        # absolute address -> status/self-clearing flag mask
+        self.flags = {}
+        # absolute address -> last value of the control bits
+        self.values = {}
+
+def _shadow_cache(dev):
+    root, offset = _resolve_root(dev)
+    cache = getattr(root, '_shadowcache', None)
+    if cache is None:
+        if getattr(root, 'NO_SHADOW', False):
+            return (None, offset)
+        cache = ShadowCache()
+        root._shadowcache = cache
+    return (cache, offset)
+
+def shadow_annotate(dev, shadow, flags={}):
+    """ Mark registers (relative to dev) as shadowed control registers. """
+    cache, offset = _shadow_cache(dev)
+    if cache is None:
+        return
+    for addr, mask in shadow.items():
+        f = flags.get(addr, 0)
+        cache.flags[addr + offset] = f
+        if (mask | f) == 0xFFFFFFFF:
+            cache.ctrl[addr + offset] = mask
+
+def shadow_invalidate(dev, address=None):
+    """ Forget shadowed values: everything on dev's root, or just one register. """
+    cache, offset = _shadow_cache(dev)
+    if cache is None:
+        return
+    if address is None:
+        cache.values.clear()
+    else:
+        cache.values.pop(address + offset, None)
+
+def shadow_write(dev, address, value):
+    """ Write a register, keeping its shadow (if any) up to date. """
+    cache, offset = _shadow_cache(dev)
+    if cache is not None:
+        ctrl = cache.ctrl.get(address + offset)
+        if ctrl is not None:
+            cache.values[address + offset] = value & ctrl
+    return dev.write(address, value)
+
+def shadow_rmw(dev, address, start, mask, value):
+    """ Set a bitfield. Only reads the register if it has to. """
+    cache, offset = _shadow_cache(dev)
+    ctrl = None if cache is None else cache.ctrl.get(address + offset)
+    if ctrl is None:
+        flags = 0 if cache is None else cache.flags.get(address + offset, 0)
+        r = dev.read(address) & ~flags
+        return dev.write(address, (r & (~(mask<<start))) | ((value&mask)<<start))
+    r = cache.values.get(address + offset)
+    if r is None:
+        r = dev.read(address) & ctrl
+    r = (r & (~(mask<<start))) | ((value&mask)<<start)
+    cache.values[address + offset] = r & ctrl
+    return dev.write(address, r)
+
+# Register map introspection.
+def regfields(cls):
+    """ name -> regfield for every register property of cls (base classes first) """
+    fields = {}
+    for c in reversed(cls.__mro__):
+        fields.update(vars(c).get('_regmap', {}))
+    return fields
+
+def _dtype(f):
+    return 'f8' if f.conversion else ('i8' if f.signed else 'u4')
+
+def decode_words(cls, words, fields=None, record=False):
+    """
+    Decode a whole array of raw register words into every field of cls
+    (or just the named ones) in one vectorized pass. words is either a
+    dict of address -> array, a 2-D array with one column per address
+    the fields use (in sorted order, like Poller history), or a 1-D
+    array if they all live in one register. Returns a dict of
+    name -> array, or a numpy structured array if record is True.
+    """
+    import numpy as np
+    allf = regfields(cls)
+    if fields is not None:
+        allf = { name : allf[name] for name in fields }
+    addrs = sorted(set(f.address for f in allf.values()))
+    if not isinstance(words, dict):
+        words = np.asarray(words, dtype=np.uint32)
+        if words.ndim == 1:
+            if len(addrs) != 1:
+                raise ValueError("1-D words but fields span %d registers" % len(addrs))
+            words = words[:, None]
+        words = { addr : words[:, i] for i, addr in enumerate(addrs) }
+    d = {}
+    for name, f in allf.items():
+        v = (np.asarray(words[f.address], dtype=np.uint32) >> np.uint32(f.start)) & np.uint32(f.mask)
+        if f.signed:
+            twid = (f.mask+1)>>1
+            v = (v.astype(np.int64) ^ twid) - twid
+        if f.conversion is not None:
+            v = np.vectorize(lambda x : f.conversion(x, True), otypes=['f8'])(v)
+        d[name] = v
+    if not record:
+        return d
+    n = len(next(iter(d.values()))) if d else 0
+    rec = np.empty(n, dtype=[ (name, _dtype(f)) for name, f in allf.items() ])
+    for name in d:
+        rec[name] = d[name]
+    return rec
+
+def _runs(addrs):
+    """ split sorted addresses into runs of consecutive registers """
+    runs = []
+    for addr in addrs:
+        if runs and addr == runs[-1][-1] + 4:
+            runs[-1].append(addr)
+        else:
+            runs.append([addr])
+    return runs
+
+def read_addresses(dev, addrs):
+    """
+    Read a sorted list of unique addresses as cheaply as possible:
+    consecutive registers are one block read, the rest go out as one
+    readmany. Returns a dict of address -> value.
+    """
+    single = []
+    words = {}
+    for run in _runs(addrs):
+        if len(run) == 1:
+            single += run
+        else:
+            words.update(zip(run, dev.readblock(run[0], len(run)).tolist()))
+    if single:
+        words.update(zip(single, dev.readmany(single)))
+    return words
+
+def snapshot(dev, fields=None, record=False):
+    """
+    Read every register field of dev (or just the named ones), reading
+    each address only once (see read_addresses). Returns a dict of
+    name -> value, or a numpy structured record if record is True.
+    """
+    allf = regfields(type(dev))
+    if fields is not None:
+        allf = { name : allf[name] for name in fields }
+    words = read_addresses(dev, sorted(set(f.address for f in allf.values())))
+    d = { name : f.decode(words[f.address]) for name, f in allf.items() }
+    if not record:
+        return d
+    import numpy as np
+    dt = [ (name, _dtype(f)) for name, f in allf.items() ]
+    return np.array(tuple(d.values()), dtype=dt)[()]
+
+# Write coalescing. Inside
+#
+# with dev.transaction():
+#     dev.hpol_notch0 = 5
+#     dev.vpol_notch0 = 7
+#     dev.write(0x1C, 1)
+#
+# writes (including the write half of bitfield setters) are queued
+# instead of sent. Writes to the same address merge into one, a read of
+# a queued address returns the queued value (so several fields in one
+# register end up as one write), and at the end everything goes out in
+# one writemany, in the order each address was FIRST written.
+# The queueing happens at dev's root (see _resolve_root), so writes
+# through dev's children are queued too, whatever the transport. Every
+# write to the root inside dev's address window gets queued: from dev's
+# offset up to dev.addrspace bytes, or to the end if that's None.
+# A transaction opened while another one is open on the same root just
+# joins it. If the block raises, nothing gets written.
+@contextmanager
+def transaction(dev):
+    root, offset = _resolve_root(dev)
+    if getattr(root, '_pending', None) is not None:
+        # already in one, just join it
+        yield dev
+        return
+    span = getattr(dev, 'addrspace', None)
+    end = None if span is None else offset + span
+    pending = {}
+    read = root.read
+    write = root.write
+    # dev might not go through the root's read/write at call time (e.g.
+    # PueoTURF binds them once), so it gets wrapped too
+    patched = [ root ] if dev is root else [ root, dev ]
+    saved = [ { k : vars(d)[k] for k in ('read', 'write') if k in vars(d) }
+              for d in patched ]
+    # shadowed setters update the shadow as they queue, so if nothing
+    # gets flushed the shadow has to go back to what it was
+    cache, _ = _shadow_cache(dev)
+    shadowed = None if cache is None else dict(cache.values)
+    def qread(addr):
+        if addr in pending:
+            return pending[addr]
+        return read(addr)
+    def qwrite(addr, value):
+        if addr < offset or (end is not None and addr >= end):
+            return write(addr, value)
+        pending[addr] = value
+    root._pending = pending
+    root.read = qread
+    root.write = qwrite
+    if dev is not root:
+        dev.read = lambda addr : qread(addr + offset)
+        dev.write = lambda addr, value : qwrite(addr + offset, value)
+    try:
+        yield dev
+    except BaseException:
+        if shadowed is not None:
+            cache.values = shadowed
+        raise
+    finally:
+        root._pending = None
+        for d, sv in zip(patched, saved):
+            for k in ('read', 'write'):
+                if k in sv:
+                    setattr(d, k, sv[k])
+                else:
+                    delattr(d, k)
+    if pending:
+        root.writemany(list(pending.keys()), list(pending.values()))
+
+# Waiting on status.
+#
+# poll_until(dev, addr, mask, value) reads addr until (word & mask) == value
+# and returns the last word read, or None if it didn't get there within
+# timeout seconds (None waits forever). How it waits is the strategy:
+#
+# 'spin'    : back-to-back reads (things that finish in an access or two:
+#             IDELAY loads, GenShift)
+# 'backoff' : SPINS back-to-back reads, then sleeps starting at MINSLEEP
+#             and doubling up to MAXSLEEP (the default)
+# 'sleep'   : MAXSLEEP between every read (slow things: flash erase)
+#
+# poll_until_multi waits on a bunch of (dev, addr, mask, value) at once:
+# each round, everything still waiting is read in one batch per root
+# (see readmany_multi). wait_until is the same thing for anything that
+# isn't a register read (e.g. a SPI flash status command).
+#
+# Every wait is recorded in poll_metrics under its name (default is the
+# class and address), so poll_metrics.report() shows where time goes.
+class PollMetrics:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # name -> [ waits, reads, total seconds, max seconds, timeouts ]
+        self.stats = {}
+
+    def record(self, name, reads, dt, timedout):
+        s = self.stats.get(name)
+        if s is None:
+            s = [ 0, 0, 0.0, 0.0, 0 ]
+            self.stats[name] = s
+        s[0] += 1
+        s[1] += reads
+        s[2] += dt
+        s[3] = max(s[3], dt)
+        s[4] += 1 if timedout else 0
+
+    def report(self, file=None):
+        print(f'{"waits":>8} {"reads":>9} {"total ms":>9} {"mean us":>9} {"max us":>9} {"timeouts":>8}  name', file=file)
+        for name, s in sorted(self.stats.items(), key=lambda kv : kv[1][2], reverse=True):
+            print(f'{s[0]:>8} {s[1]:>9} {s[2]*1E3:>9.2f} {s[2]*1E6/s[0]:>9.1f} {s[3]*1E6:>9.1f} {s[4]:>8}  {name}', file=file)
+
+poll_metrics = PollMetrics()
+
+SPINS = 4
+MINSLEEP = 50E-6
+MAXSLEEP = 10E-3
+
+def _poll(check, timeout, strategy, name):
+    """ check() returns True when done. Returns (done, reads). """
+    start = time.perf_counter()
+    end = None if timeout is None else start + timeout
+    reads = 0
+    slp = MINSLEEP
+    while True:
+        reads += 1
+        if check():
+            done = True
+            break
+        now = time.perf_counter()
+        if end is not None and now >= end:
+            done = False
+            break
+        if strategy == 'sleep':
+            dt = MAXSLEEP
+        elif strategy == 'backoff' and reads >= SPINS:
+            dt = slp
+            slp = min(slp*2, MAXSLEEP)
+        elif strategy in ('spin', 'backoff'):
+            continue
+        else:
+            raise ValueError("strategy must be 'spin', 'backoff' or 'sleep'")
+        time.sleep(dt if end is None else min(dt, end - now))
+    poll_metrics.record(name, reads, time.perf_counter() - start, not done)
+    return done, reads
+
+def wait_until(read, done, timeout=1.0, strategy='backoff', name='wait_until'):
+    """ Calls read() until done(value). Returns the last value, or None on timeout. """
+    last = [ None ]
+    def check():
+        last[0] = read()
+        return done(last[0])
+    ok, reads = _poll(check, timeout, strategy, name)
+    return last[0] if ok else None
+
+def poll_until(dev, addr, mask, value, timeout=1.0, strategy='backoff', name=None):
+    """ Reads addr until (word & mask) == value. Returns the word, or None on timeout. """
+    if name is None:
+        name = f'{type(dev).__name__}@{addr:#x}'
+    return wait_until(lambda : dev.read(addr), lambda r : (r & mask) == value,
+                      timeout, strategy, name)
+
+def poll_until_multi(accesses, timeout=1.0, strategy='backoff', name='poll_until_multi'):
+    """
+    accesses is a list of (dev, addr, mask, value). Returns the words
+    (same order), with None for anything that timed out.
+    """
+    rv = [ None ]*len(accesses)
+    waiting = list(range(len(accesses)))
+    def check():
+        r = readmany_multi([ accesses[i][:2] for i in waiting ])
+        still = []
+        for i, word in zip(waiting, r):
+            if (word & accesses[i][2]) == accesses[i][3]:
+                rv[i] = word
+            else:
+                still.append(i)
+        waiting[:] = still
+        return not waiting
+    _poll(check, timeout, strategy, name)
+    return rv
+
 class dev_submod:
+    # size of the address window, if it's known (see transaction)
+    addrspace = None
+    # control registers that can be shadowed, see ShadowCache
+    shadow = {}
+    # status/self-clearing flags in them
+    shadow_flags = {}
+
     def __init__(self, dev, base):
         self.dev = dev
         self.base = base
+        # Resolve the root and absolute offset ONCE, here, so that an
+        # access from e.g. a SURF submodule goes straight to the EthDevice
+        # instead of through every bridge layer in between.
+        # self.dev/self.base are still the real parent for everything else.
+        root, offset = _resolve_root(dev)
+        self._root = root
+        self._offset = offset + base
+        if self.shadow:
+            shadow_annotate(self, self.shadow, self.shadow_flags)
+
+    def _resolve(self):
+        return (self._root, self._offset)
+
+    def transaction(self):
+        """ Queue and merge writes until the with block exits. """
+        return transaction(self)
+
+    def snapshot(self, fields=None, record=False):
+        """ Read all (or the named) register fields at once, each address read once. """
+        return snapshot(self, fields, record)
+
+    @classmethod
+    def decode_words(cls, words, fields=None, record=False):
+        """ Vectorized decode of raw register words into fields, see decode_words(). """
+        return decode_words(cls, words, fields, record)
+
+    def poll_until(self, addr, mask, value, timeout=1.0, strategy='backoff', name=None):
+        """ Wait for (read(addr) & mask) == value, see poll_until(). """
+        return poll_until(self, addr, mask, value, timeout, strategy, name)
 
     def read(self, addr):
-#        print("dev_submod: addr", hex(addr+self.base))
-        return self.dev.read(addr + self.base)
+#        print("dev_submod: addr", hex(addr+self._offset))
+        return self._root.read(addr + self._offset)
 
     def write(self, addr, val):
-        return self.dev.write(addr + self.base, val)
+        return self._root.write(addr + self._offset, val)
     
     def writeto(self, addr, val):
-        return self.dev.writeto(addr + self.base, val)
+        return self._root.writeto(addr + self._offset, val)
+
+    # Batched accesses. These get pipelined if whatever is underneath
+    # can do it (e.g. EthDevice), otherwise they're just loops.
+    def readmany(self, addrs):
+        addrs = [ addr + self._offset for addr in addrs ]
+        readmany = getattr(self._root, 'readmany', None)
+        if readmany is None:
+            return [ self._root.read(addr) for addr in addrs ]
+        return readmany(addrs)
+
+    def writemany(self, addrs, values):
+        addrs = [ addr + self._offset for addr in addrs ]
+        writemany = getattr(self._root, 'writemany', None)
+        if writemany is None:
+            for addr, value in zip(addrs, values):
+                self._root.write(addr, value)
+            return
+        return writemany(addrs, values)
     
+
+    def readblock(self, base, n, stride=4):
+        return self._root.readblock(base + self._offset, n, stride)
+
+    def writeblock(self, base, data, stride=4):
+        return self._root.writeblock(base + self._offset, data, stride)
@@ -5,13 +5,39 @@ import ipaddress
 
 class EthDevice:
     DAQ_IP = "10.68.65.81"
-    
+
+    # The tag is only 4 bits, so at most 15 transactions can be in
+    # flight: keeping one tag free means a reply can never be mistaken
+    # for the transaction submitted 16 tags earlier.
+    MAX_OUTSTANDING = 15
+
+    class Transaction:
+        """
+        A submitted register access. result() waits for the reply and
+        returns the read value (or 4 for a write, like write() does).
+        """
+        __slots__ = [ 'dev', 'tag', 'addr', 'addrword', 'write', 'value', 'done' ]
+
+        def __init__(self, dev, tag, addr, write):
+            self.dev = dev
+            self.tag = tag
+            self.addr = addr
+            # what the reply echoes back
+            self.addrword = (addr & 0xFFFFFFF) | (tag << 28)
+            self.write = write
+            self.value = None
+            self.done = False
+
+        def result(self):
+            return self.dev.result(self)
+
     def __init__(self,
                  remote_ip = None,
                  remote_rp = 21618,
                  remote_wp = 21623,
                  local_ip = "10.68.65.1",
-                 local_port = 21362):
+                 local_port = 21362,
+                 timeout = None):
         if remote_ip is None:
             remote_ip = self.DAQ_IP
         self.remote_ip = ipaddress.ip_address(remote_ip)
@@ -19,57 +45,130 @@ class EthDevice:
         self.remote_writeport = remote_wp
         self.local_ip = ipaddress.ip_address(local_ip)
         self.local_port = local_port
+        # these get used on every access, so build them once
+        self._raddr = (str(self.remote_ip), self.remote_readport)
+        self._waddr = (str(self.remote_ip), self.remote_writeport)
 
         self.sock = socket.socket(socket.AF_INET,
                                   socket.SOCK_DGRAM)
         self.sock.bind( (str(self.local_ip), self.local_port))
+        # None means block forever, like it always has
+        self.sock.settimeout(timeout)
         # open by reading ID register with tag 0
         msg = b'\x00'*4
-        self.sock.sendto( msg[::-1],
-                          (str(self.remote_ip), self.remote_readport))
+        self.sock.sendto( msg[::-1], self._raddr)
         data, addr = self.sock.recvfrom(1024)
         resp = data[::-1]
         print("Connected to device: ", resp[0:4].decode())
         self.tag = 1
+        # transactions in flight, by tag
+        self.pending = {}
+        # late replies that got dropped (see _receive)
+        self.stale = 0
 
     def close(self):
         self.sock.close()
-        
-    def read(self, addr):
-        addr = (addr & 0xFFFFFFF) | (self.tag << 28)
-        d = addr.to_bytes(4, 'little')
 
-        # this is the Be Bold method
-        # the "correct" method here is to create a separate process/thread
-        # which handles the send/receive/repeat request if lost method.
-        # We DO NOT have to use the cs port here, the read/write guys
-        # respond to whatever port sent them data.
-        # So it probably makes sense to completely farm off the event
-        # stuff too.
+    # This is the pipelined engine. submit() fires off a request and
+    # returns right away, result() collects replies (in whatever order
+    # they arrive) until the one asked for is done. If the window is
+    # full, or if the next tag is still waiting on a reply (replies can
+    # come back out of order), submit() retires replies until it can send.
+    #
+    # We still do NOT retry lost packets here: if a reply never comes
+    # back, either the timeout fires (and everything in flight is
+    # failed) or, with no timeout, recvfrom blocks forever. Replies
+    # that show up after their timeout don't match anything pending
+    # (tag or echoed address) and get dropped, and counted in stale.
+    def submit(self, addr, value=None):
+        """
+        Submit a read (value is None) or a write without waiting for
+        the reply. Returns an EthDevice.Transaction.
 
+        Reads and writes go to separate UDP ports, so they are NOT
+        ordered with respect to each other: a read submitted after a
+        write isn't guaranteed to see it. Wait for the write's result()
+        first if that matters (write() and writemany() do).
+        """
+        while len(self.pending) >= self.MAX_OUTSTANDING or self.tag in self.pending:
+            self._receive()
+        tag = self.tag
+        txn = self.Transaction(self, tag, addr, value is not None)
+        addr = txn.addrword
         # we do NOT need to reverse bytes here
-        self.sock.sendto( d, (str(self.remote_ip), self.remote_readport))
-        data, addr = self.sock.recvfrom(1024)
+        if value is None:
+            self.sock.sendto(addr.to_bytes(4, 'little'), self._raddr)
+        else:
+            self.sock.sendto(addr.to_bytes(4, 'little') + value.to_bytes(4, 'little'),
+                             self._waddr)
+        self.pending[tag] = txn
+        self.tag = (tag + 1) & 0xF
+        return txn
+
+    def result(self, txn):
+        """ Wait for a submitted transaction and return its value. """
+        while not txn.done:
+            self._receive()
+        return txn.value
+
+    def _receive(self):
+        try:
+            data, addr = self.sock.recvfrom(1024)
+        except socket.timeout:
+            lost = list(self.pending.keys())
+            self.pending.clear()
+            self._drain()
+            raise IOError("Timed out waiting for tags %s" % lost)
         resp = data[::-1]
         tag = (resp[4] >> 4)
-        if tag != self.tag:
-            raise IOError("Incorrect tag received: expected %d got %d:" %
-                          (self.tag, tag), data.hex())
-        self.tag = (self.tag + 1) & 0xF
-        return struct.unpack(">I", resp[0:4])[0]
-        
+        txn = self.pending.get(tag)
+        if txn is None or struct.unpack(">I", resp[4:8])[0] != txn.addrword:
+            # stale reply to something that already timed out: whoever
+            # called us is still waiting, so they'll just come back
+            self.stale += 1
+            return
+        del self.pending[tag]
+        txn.value = 4 if txn.write else struct.unpack(">I", resp[0:4])[0]
+        txn.done = True
+
+    # toss whatever's sitting in the socket after a timeout
+    def _drain(self):
+        timeout = self.sock.gettimeout()
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recvfrom(1024)
+        except OSError:
+            pass
+        finally:
+            self.sock.settimeout(timeout)
+
+    def read(self, addr):
+        return self.result(self.submit(addr))
+
     def write(self, addr, value):
-        addr = (addr & 0xFFFFFFF) | (self.tag << 28)
-        d = addr.to_bytes(4, 'little') + value.to_bytes(4, 'little')
-        self.sock.sendto( d, (str(self.remote_ip), self.remote_writeport))
-        data, addr = self.sock.recvfrom(1024)
-        resp = data[::-1]
-        tag = (resp[4] >> 4)
-        if tag != self.tag:
-            raise IOError("Incorrect tag received: expected %d got %d:" %
-                          (self.tag, tag), data.hex())
-        self.tag = (self.tag + 1) & 0xF
-        return 4
-    
-    
-        
+        return self.result(self.submit(addr, value))
+
+    def readmany(self, addrs):
+        """ Read a list of addresses, keeping the window full. """
+        txns = [ self.submit(addr) for addr in addrs ]
+        return [ self.result(txn) for txn in txns ]
+
+    def writemany(self, addrs, values):
+        """ Write a list of values to a list of addresses, keeping the window full. """
+        txns = [ self.submit(addr, value) for addr, value in zip(addrs, values) ]
+        for txn in txns:
+            self.result(txn)
+        return 4*len(txns)
+
+    def readblock(self, base, n, stride=4):
+        """ Read n registers starting at base, returned as a numpy.uint32 array. """
+        # numpy is only imported when it's needed, it's slow to import
+        import numpy as np
+        return np.array(self.readmany(range(base, base+n*stride, stride)),
+                        dtype=np.uint32)
+
+    def writeblock(self, base, data, stride=4):
+        """ Write an array of values to consecutive registers starting at base. """
+        data = [ int(v) for v in data ]
+        return self.writemany(range(base, base+len(data)*stride, stride), data)
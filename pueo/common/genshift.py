@@ -1,8 +1,25 @@
-from .bf import bf
+from .bf import field
 from .dev_submod import dev_submod
 
 from enum import Enum
 
+# MODCONF
+PRESCALE = field(7, 0)
+DISABLE_TRIS = field(15, 8)
+# DEVCONF: GPIO n is bit n of each of the GPIO fields
+DEV_ENABLE = field(7, 0)
+GPIO_TRI = 8
+GPIO_IN = 16
+GPIO_OUT = 24
+# DATA
+DATA_IN = field(7, 0)
+AUX_IN = field(15, 8)
+DATA_OUT = field(23, 16)
+NUM_BITS = field(26, 24)
+BIT_ORDER = field(29)
+START = field(30)
+BUSY = 1<<31
+
 class GenShift(dev_submod):
     map = { 'MODCONF' : 0x0,
             'DEVCONF' : 0x4,
@@ -24,51 +41,40 @@ class GenShift(dev_submod):
 
     # disableTris forces specified interfaces to remain driven
     def setup(self, disableTris=0x0):
-        modconf = bf(0)
-        modconf[7:0] = 0
-        modconf[15:8] = disableTris
-        self.write(self.map['MODCONF'], int(modconf))
+        self.write(self.map['MODCONF'], DISABLE_TRIS.set(0, disableTris))
 
     def enable(self, interfaceNumber, prescale=0):
-        modconf = bf(self.read(self.map['MODCONF']))
-        modconf[7:0] = prescale
-        self.write(self.map['MODCONF'], int(modconf))
-        devconf = bf(self.read(self.map['DEVCONF']))
-        devconf[7:0] = (1<<interfaceNumber)
-        self.write(self.map['DEVCONF'], int(devconf))
+        modconf = self.read(self.map['MODCONF'])
+        self.write(self.map['MODCONF'], PRESCALE.set(modconf, prescale))
+        devconf = self.read(self.map['DEVCONF'])
+        self.write(self.map['DEVCONF'], DEV_ENABLE.set(devconf, 1<<interfaceNumber))
 
     def disable(self):
-        devconf = bf(self.read(self.map['DEVCONF']))
-        devconf[7:0] = 0
-        self.write(self.map['DEVCONF'], int(devconf))
+        devconf = self.read(self.map['DEVCONF'])
+        self.write(self.map['DEVCONF'], DEV_ENABLE.set(devconf, 0))
 
     # shift in data, and don't care about return value
     def shiftin(self, val, auxVal=0, bitOrder=BitOrder.LSB_FIRST, numBits=8):
         dat = self.prepare(val, auxVal, bitOrder, numBits)
-        self.write(self.map['DATA'], int(dat))
+        self.write(self.map['DATA'], dat)
         return dat
 
     # shift in and get return value
     def shift(self, val, auxVal=0, bitOrder=BitOrder.LSB_FIRST, numBits=8):
-        dat = self.shiftin(val, auxVal, bitOrder, numBits)
-        ntries = 0
-        dat[31:0] = self.read(self.map['DATA'])
-        while (dat[31] == 1 and ntries < 100):
-            dat[31:0] = self.read(self.map['DATA'])
-            ntries += 1
-        if ntries == 100:
+        self.shiftin(val, auxVal, bitOrder, numBits)
+        dat = self.poll_until(self.map['DATA'], BUSY, 0, timeout=0.1, strategy='spin')
+        if dat is None:
             print("Sequence did not complete?!?")
             return 0
-        return dat[23:16]
+        return DATA_OUT.get(dat)
 
+    # returns the DATA value to write, as an int
     def prepare(self, val, auxVal, bitOrder, numBits):
-        dat = bf(0)
-        dat[26:24] = numBits-1
-        dat[15:8] = auxVal
-        dat[7:0] = val
-        dat[30] = 1
-        dat[29] = bitOrder.value
-        return dat
+        dat = NUM_BITS.set(0, numBits-1)
+        dat = AUX_IN.set(dat, auxVal)
+        dat = DATA_IN.set(dat, val)
+        dat = START.set(dat, 1)
+        return BIT_ORDER.set(dat, bitOrder.value)
     
     # Transferring LOTS of data on the serial connection
     # is best done with blockshiftin.
@@ -87,53 +93,65 @@ class GenShift(dev_submod):
         if self.dev.multiwrite is None:
             # sigh, we don't have multiwrite capability
             # so hack it ourselves
-            self.write(self.map['DATA'], int(prepareVal))
-            dat = bf(prepareVal)
+            dat = int(prepareVal)
+            self.write(self.map['DATA'], dat)
             for b in data:
-                dat[7:0] = b
-                self.write(self.map['DATA'], int(dat))
+                self.write(self.map['DATA'], DATA_IN.set(dat, b))
         else:            
             multiwriteAddr = (self.base + self.map['DATA']) | (1<<22)
             toWrite = bytearray([int(prepareVal) & 0xFF]) + data
             self.dev.multiwrite(multiwriteAddr, toWrite)
 
     def blocklastout(self):
-        r = bf(self.read(self.map['DATA']))
-        return r[23:16]
+        return DATA_OUT.get(self.read(self.map['DATA']))
+
+    # Shift in num zero bytes, returning the byte that came out each
+    # time: the same as num blockshiftin(0, b'') + blocklastout()
+    # pairs. If the device can queue (serial), all of those go out
+    # as one batch instead of 2*num round trips.
+    def blockshiftout(self, num):
+        if getattr(self.dev, 'queued', None) is None:
+            rv = []
+            for i in range(num):
+                self.blockshiftin(0, b'')
+                rv.append(self.blocklastout())
+            return rv
+        multiwriteAddr = (self.base + self.map['DATA']) | (1<<22)
+        ops = []
+        for i in range(num):
+            ops.append((multiwriteAddr, b'\x00'))
+            ops.append((self.base + self.map['DATA'], 4))
+        return [ pk[2] for pk in self.dev.queued(ops)[1::2] ]
         
     # these are fast set fns: call prepare_set_gpio once, then you
-    # you can just call set_gpio after that
+    # you can just call set_gpio after that. prep is just the DEVCONF
+    # value (an int) with the GPIO driven.
     def prepare_set_gpio(self, num):
-        prep = bf(self.read(self.map['DEVCONF']))
-        prep[8+num] = 0
-        return prep
+        return self.read(self.map['DEVCONF']) & ~(1<<(GPIO_TRI+num))
 
     def set_gpio(self, prep, num, hilo):
-        prep[24+num] = 1 if int(hilo) else 0
-        self.write(self.map['DEVCONF'], int(prep))
+        out = 1<<(GPIO_OUT+num)
+        self.write(self.map['DEVCONF'], (prep | out) if int(hilo) else (prep & ~out))
     
     def gpio(self, num, state):
-        devconf = bf(self.read(self.map['DEVCONF']))
+        devconf = self.read(self.map['DEVCONF'])
+        tri = 1<<(GPIO_TRI+num)
+        out = 1<<(GPIO_OUT+num)
         
         if state == self.GpioState.GPIO_LOW:
-            devconf[8+num] = 0
-            devconf[24+num] = 0
-            self.write(self.map['DEVCONF'], int(devconf))
+            self.write(self.map['DEVCONF'], devconf & ~(tri | out))
             return 0
         elif state == self.GpioState.GPIO_HIGH:
-            devconf[8+num] = 0
-            devconf[24+num] = 1
-            self.write(self.map['DEVCONF'], int(devconf))
+            self.write(self.map['DEVCONF'], (devconf & ~tri) | out)
             return 1
         elif state == self.GpioState.GPIO_TRI:
-            if devconf[8+num] == 1:
+            if devconf & tri:
                 # already set
-                return devconf[16+num]
+                return (devconf >> (GPIO_IN+num)) & 1
             else:
-                devconf[8+num] = 1
-                self.write(self.map['DEVCONF'], int(devconf))
-                devconf[31:0] = self.read(self.map['DEVCONF'])
-                return devconf[16+num]
+                self.write(self.map['DEVCONF'], devconf | tri)
+                devconf = self.read(self.map['DEVCONF'])
+                return (devconf >> (GPIO_IN+num)) & 1
     
 class GenShiftGPIO:
     def __init__(self, dev, num):
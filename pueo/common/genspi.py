@@ -46,7 +46,7 @@ class GenSPI:
     # gpio_prep is used with enter/exit because the assumption is nothing
     # else will use it between then and we can use Fast Stuff
     def chipselect(self, v):
-        if self.gpio_prep:
+        if self.gpio_prep is not None:
             self.dev.set_gpio(self.gpio_prep, self.cspin,
                               self.highint if v else self.lowint)
         else:
@@ -97,11 +97,7 @@ class GenSPI:
                 txd += bytes(num_dummy_bytes + 1)
                 self.dev.blockshiftin(val, txd)
                 rv.append(self.dev.blocklastout())
-                num_read_bytes = num_read_bytes - 1
-                while num_read_bytes > 0:
-                    self.dev.blockshiftin(0, b'')
-                    rv.append(self.dev.blocklastout())
-                    num_read_bytes = num_read_bytes - 1
+                rv += self.dev.blockshiftout(num_read_bytes - 1)
                 self.chipselect(False)
                 return rv
         else:
@@ -0,0 +1,67 @@
+import mmap
+import os
+
+# Pure-Python AXI bridge. Instead of a ctypes call per access (like
+# PyAXIBridge), map the bridge region once and index a 32-bit
+# memoryview of it. Everything, blocks included, goes through that
+# view one word at a time: numpy/memcpy copies can use wider or
+# unaligned accesses, which the bridge doesn't do.
+#
+# path can be:
+# /dev/mem      : base is the physical address (needs root)
+# /dev/uioN     : a UIO node for the bridge, base is ignored (map 0)
+# anything else : a regular file at least size bytes long, for testing
+#
+# >>> dev = MmapAXIBridge(*PueoTURF.axilite_bridge())
+# >>> hex(dev.read(0))
+# '0x54555246'
+class MmapAXIBridge:
+    def __init__(self, base, size, path="/dev/mem"):
+        self.base = base
+        self.size = size
+        self.path = path
+        # only /dev/mem wants the physical address as the offset
+        offset = base if path == "/dev/mem" else 0
+        # O_SYNC gets us an uncached mapping from /dev/mem
+        self.fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        self.mm = mmap.mmap(self.fd, size,
+                            mmap.MAP_SHARED,
+                            mmap.PROT_READ | mmap.PROT_WRITE,
+                            offset=offset)
+        self.mv = memoryview(self.mm).cast('I')
+
+    def close(self):
+        # the view has to go before the mmap can
+        self.mv.release()
+        self.mm.close()
+        os.close(self.fd)
+
+    def read(self, addr):
+        return self.mv[addr >> 2]
+
+    def write(self, addr, value):
+        self.mv[addr >> 2] = value & 0xFFFFFFFF
+
+    def readmany(self, addrs):
+        mv = self.mv
+        return [ mv[addr >> 2] for addr in addrs ]
+
+    def writemany(self, addrs, values):
+        mv = self.mv
+        for addr, value in zip(addrs, values):
+            mv[addr >> 2] = int(value) & 0xFFFFFFFF
+
+    def readblock(self, base, n, stride=4):
+        import numpy as np
+        mv = self.mv
+        idx = base >> 2
+        step = stride >> 2
+        return np.array([ mv[i] for i in range(idx, idx+n*step, step) ],
+                        dtype=np.uint32)
+
+    def writeblock(self, base, data, stride=4):
+        mv = self.mv
+        idx = base >> 2
+        step = stride >> 2
+        for i, value in zip(range(idx, idx+len(data)*step, step), data):
+            mv[i] = int(value) & 0xFFFFFFFF
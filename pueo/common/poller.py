@@ -0,0 +1,116 @@
+import threading
+import time
+
+from .dev_submod import regfields, read_addresses, decode_words
+
+# Change-detection poller built on the register metadata.
+#
+# >>> p = Poller(rate=2)
+# >>> p.add(turf.event, callback=print)
+# >>> p.add(tio.surfturf, [ 'surf_live', 'surf_misaligned', 'train_in_req',
+# ...                       'train_out_rdy', 'boot_seen' ], callback=print)
+# >>> p.start()
+#
+# Every cycle each watched object costs the minimum number of reads
+# (each address once, consecutive ones as a block). The raw words go
+# into a ring buffer, the fields are pulled out of all of them with
+# numpy in one go, and the callback only hears about the fields that
+# changed: callback(dev, { name : (old, new) }). The first poll just
+# fills in the initial values, it doesn't report anything.
+class Poller:
+    class Watch:
+        """ One watched object: its fields, addresses and raw history """
+        def __init__(self, dev, fields, callback, depth):
+            import numpy as np
+            self.dev = dev
+            self.callback = callback
+            allf = regfields(type(dev))
+            if fields is None:
+                fields = list(allf.keys())
+            self.fields = [ allf[name] for name in fields ]
+            self.names = list(fields)
+            self.addrs = sorted(set(f.address for f in self.fields))
+            # per-field: which column, shift and mask
+            col = { addr : i for i, addr in enumerate(self.addrs) }
+            self.col = np.array([ col[f.address] for f in self.fields ])
+            self.start = np.array([ f.start for f in self.fields ], dtype=np.uint32)
+            self.mask = np.array([ f.mask for f in self.fields ], dtype=np.uint32)
+            # ring buffer
+            self.words = np.zeros((depth, len(self.addrs)), dtype=np.uint32)
+            self.times = np.zeros(depth)
+            self.count = 0
+            self.last = None
+
+        def history(self):
+            """ (times, words) for everything still in the ring, oldest first """
+            import numpy as np
+            depth = len(self.times)
+            n = min(self.count, depth)
+            idx = (np.arange(self.count - n, self.count)) % depth
+            return self.times[idx], self.words[idx]
+
+        def decoded(self, record=False):
+            """ (times, fields) for everything still in the ring, see decode_words() """
+            times, words = self.history()
+            return times, decode_words(type(self.dev), words, list(self.names), record)
+
+    def __init__(self, rate=1.0, depth=1024):
+        self.period = 1.0/rate
+        self.depth = depth
+        self.watches = []
+        self.thread = None
+        self.running = False
+
+    def add(self, dev, fields=None, callback=None):
+        """ Watch dev's register fields (all of them, or the named ones) """
+        w = self.Watch(dev, fields, callback, self.depth)
+        self.watches.append(w)
+        return w
+
+    def poll(self):
+        """ One cycle over everything being watched """
+        # numpy is only imported when it's needed, it's slow to import
+        import numpy as np
+        for w in self.watches:
+            words = read_addresses(w.dev, w.addrs)
+            row = np.array([ words[addr] for addr in w.addrs ], dtype=np.uint32)
+            slot = w.count % self.depth
+            w.words[slot] = row
+            w.times[slot] = time.time()
+            w.count += 1
+            vals = (row[w.col] >> w.start) & w.mask
+            if w.last is not None and w.callback is not None:
+                changed = np.nonzero(vals != w.last)[0]
+                if len(changed):
+                    w.callback(w.dev,
+                               { w.names[i] : (w.fields[i].decode(int(w.last[i]) << int(w.start[i])),
+                                               w.fields[i].decode(int(vals[i]) << int(w.start[i])))
+                                 for i in changed })
+            w.last = vals
+
+    def run(self, count=None):
+        """ Poll at the rate, count times (or until stop()) """
+        self.running = True
+        n = 0
+        next = time.monotonic()
+        while self.running and (count is None or n < count):
+            self.poll()
+            n += 1
+            next += self.period
+            dt = next - time.monotonic()
+            if dt > 0:
+                time.sleep(dt)
+            else:
+                # fell behind, don't try to catch up
+                next = time.monotonic()
+
+    def start(self):
+        """ Poll in a background thread """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
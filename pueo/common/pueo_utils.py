@@ -1,5 +1,6 @@
 # General common PUEO utility functions
 from .bf import bf
+import os
 
 train32 = 0xA55A6996
 train8 = 0x6A
@@ -23,3 +24,108 @@ def check_eye(eye_val, bw=32, trainValue=train32):
             return i
     return None
 
+
+# Adaptive eye search, for scans where only error/no error matters
+# (e.g. the RXCLK phase scans). Instead of sampling all width
+# positions, sample every stride-th one (wrapping around), then bisect
+# between neighbors that disagree to find exactly where each
+# transition is. The positions that weren't sampled are filled in
+# from their neighbor on the same side of the transition, so the
+# result is a full-length scan that gives the same eyes from the
+# process functions. Anything narrower than stride that sits between
+# two samples gets missed: stride=None (or 1) is the full sweep, and
+# if no sample is clean at all, the rest get sampled anyway.
+# sample(i) returns the error count at position i.
+def adaptive_eyescan(sample, width, stride=16):
+    if stride is None or stride <= 1:
+        return [ sample(i) for i in range(width) ]
+    sc = [ None ]*width
+    def get(i):
+        i = i % width
+        if sc[i] is None:
+            sc[i] = sample(i)
+        return sc[i]
+    pts = list(range(0, width, stride))
+    if all(get(p) for p in pts):
+        return [ get(i) for i in range(width) ]
+    for k, a in enumerate(pts):
+        # last interval wraps back to 0
+        b = pts[k+1] if k+1 < len(pts) else width
+        lo = a
+        hi = b
+        if (get(a) == 0) != (get(b) == 0):
+            while hi - lo > 1:
+                mid = (lo+hi)//2
+                if (get(mid) == 0) == (get(a) == 0):
+                    lo = mid
+                else:
+                    hi = mid
+        for i in range(a+1, b):
+            if sc[i] is None:
+                sc[i] = sc[a] if i < hi else get(b)
+    return sc
+
+# Device DNA. Writing the top bit reloads the DNA shift register and
+# then each read shifts out one bit, MSB first. The reads don't depend
+# on each other, so they all go out as one batch (pipelined on
+# Ethernet, one frame on serial, one ioctl on SPI).
+DNA_BITS = 57
+
+def read_dna(dev, addr=0x8):
+    return read_dna_many(dev, [ addr ])[0]
+
+# Several DNAs that are all reachable through dev (e.g. every FPGA
+# in the crate through the TURF's transport) in one batch.
+def read_dna_many(dev, addrs):
+    dev.writemany(addrs, [ 0x80000000 ]*len(addrs))
+    r = dev.readmany([ addr for addr in addrs for i in range(DNA_BITS) ])
+    dnas = []
+    for i in range(len(addrs)):
+        dnaval = 0
+        for b in r[i*DNA_BITS:(i+1)*DNA_BITS]:
+            dnaval = (dnaval << 1) | (b & 0x1)
+        dnas.append(dnaval)
+    return dnas
+
+# The DNA never changes, so it's cached on disk, keyed by how we got to
+# the device (devpath, e.g. 'eth:10.68.65.81/link1/surf3') and its
+# DATEVERSION. If a board gets swapped for another one running the same
+# firmware, the cache can't tell: use refresh=True (or delete the file).
+DNA_CACHE = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                        os.path.expanduser('~/.cache')),
+                         'pueo', 'dna.json')
+
+def dna_key(devpath, dateversion):
+    return '%s@%8.8x' % (devpath, dateversion)
+
+def dna_cache_load(cache=None):
+    import json
+    try:
+        with open(DNA_CACHE if cache is None else cache) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def dna_cache_store(d, cache=None):
+    import json
+    cache = DNA_CACHE if cache is None else cache
+    # it's just a cache, if we can't write it, whatever
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        tmp = cache + '.%d' % os.getpid()
+        with open(tmp, 'w') as f:
+            json.dump(d, f, indent=1, sort_keys=True)
+        os.replace(tmp, cache)
+    except OSError:
+        pass
+
+def cached_dna(dev, devpath, dateversion, addr=0x8, refresh=False, cache=None):
+    if devpath is None:
+        return read_dna(dev, addr)
+    key = dna_key(devpath, dateversion)
+    d = dna_cache_load(cache)
+    if not refresh and key in d:
+        return d[key]
+    d[key] = read_dna(dev, addr)
+    dna_cache_store(d, cache)
+    return d[key]
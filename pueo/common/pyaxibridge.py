@@ -43,3 +43,20 @@ class PyAXIBridge:
         atexit.register(close)
         self.read = lambda x : self.lib.libaxibridge32_read(self.handle, x)
         self.write = lambda x, y : self.lib.libaxibridge32_write(self.handle, x, y)
+
+    def readmany(self, addrs):
+        return [ self.read(addr) for addr in addrs ]
+
+    def writemany(self, addrs, values):
+        for addr, value in zip(addrs, values):
+            self.write(addr, value)
+
+    # There's no block access in libaxibridge32, so these are just loops.
+    def readblock(self, base, n, stride=4):
+        import numpy as np
+        return np.array(self.readmany(range(base, base+n*stride, stride)),
+                        dtype=np.uint32)
+
+    def writeblock(self, base, data, stride=4):
+        data = [ int(v) for v in data ]
+        self.writemany(range(base, base+len(data)*stride, stride), data)
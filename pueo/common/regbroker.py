@@ -0,0 +1,168 @@
+import asyncio
+import os
+import socket
+import struct
+
+from .asyncethdevice import AsyncEthDevice
+
+# Register-access broker. EthDevice binds a fixed local port and
+# keeps its own tag counter, so only one process can talk to the
+# TURF at a time. The broker owns the one UDP endpoint (through an
+# AsyncEthDevice, so tags are handed out in one place) and local
+# clients talk to it over a Unix socket with BrokerDevice, which
+# looks just like any other transport.
+#
+# Every client request is a batch. All the batches from all the
+# clients share the same 15-deep tag window, so they get pipelined
+# together on the wire, and each reply goes back to whoever asked.
+# A read of an address another client already has a read in flight
+# for just waits on that one (a write to the address ends that).
+# Reads within one batch are never merged, and neither are writes:
+# plenty of registers shift or strobe on every access (DNA, bitslip,
+# FWU data). Clients coalesce their own writes with transaction().
+#
+# The socket lives in $XDG_RUNTIME_DIR (or /run/pueo), and it's only
+# accessible to the user running the broker unless mode says otherwise.
+#
+# Wire format (little-endian):
+# request  : count (I), then count x [ op (B), addr (I), value (I) ]
+# response : status (B), count (I), then count x value (I)
+#            if status is nonzero, count bytes of error text instead
+class RegisterBroker:
+    DEFAULT_PATH = os.path.join(os.environ.get('XDG_RUNTIME_DIR', '/run/pueo'),
+                                'pueo_turf_broker')
+    OP_READ = 0
+    OP_WRITE = 1
+
+    def __init__(self,
+                 path = DEFAULT_PATH,
+                 remote_ip = None,
+                 local_ip = "10.68.65.1",
+                 local_port = 21362,
+                 mode = 0o600):
+        self.path = path
+        self.mode = mode
+        # address -> read in flight, and how many reads got merged
+        self.reads = {}
+        self.merged = 0
+        self.dev = AsyncEthDevice(remote_ip = remote_ip,
+                                  local_ip = local_ip,
+                                  local_port = local_port)
+
+    def serve_forever(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        await self.dev.connect()
+        os.makedirs(os.path.dirname(self.path), mode=0o755, exist_ok=True)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # nobody else gets a window to connect before the chmod
+        umask = os.umask(0o177)
+        try:
+            server = await asyncio.start_unix_server(self._client, path=self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, self.mode)
+        print("Broker listening on", self.path)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.dev.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def _op(self, op, addr, value, mine):
+        if op != self.OP_READ:
+            # later reads have to see this write
+            self.reads.pop(addr, None)
+            return self.dev.write(addr, value)
+        fut = self.reads.get(addr)
+        if fut is not None and fut not in mine:
+            self.merged += 1
+            return fut
+        fut = asyncio.ensure_future(self.dev.read(addr))
+        self.reads[addr] = fut
+        fut.add_done_callback(lambda f : self._read_done(addr, f))
+        mine.add(fut)
+        return fut
+
+    def _read_done(self, addr, fut):
+        if self.reads.get(addr) is fut:
+            del self.reads[addr]
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                n, = struct.unpack('<I', await reader.readexactly(4))
+                ops = struct.iter_unpack('<BII', await reader.readexactly(9*n))
+                try:
+                    mine = set()
+                    vals = await asyncio.gather(*[ self._op(*op, mine) for op in ops ])
+                    writer.write(struct.pack('<BI%dI' % n, 0, n, *vals))
+                except Exception as e:
+                    msg = repr(e).encode()
+                    writer.write(struct.pack('<BI', 1, len(msg)) + msg)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # client went away
+            pass
+        finally:
+            writer.close()
+
+
+class BrokerDevice:
+    """ Client side of the RegisterBroker. Drop-in for EthDevice. """
+    # other processes write through the broker too, so we can't
+    # trust a local shadow of anything (see dev_submod.ShadowCache)
+    NO_SHADOW = True
+
+    def __init__(self, path = RegisterBroker.DEFAULT_PATH):
+        self.path = path
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+
+    def close(self):
+        self.sock.close()
+
+    def _recv(self, n):
+        rb = bytearray()
+        while len(rb) < n:
+            d = self.sock.recv(n - len(rb))
+            if not d:
+                raise IOError("broker closed the connection")
+            rb.extend(d)
+        return bytes(rb)
+
+    def _transact(self, ops):
+        msg = bytearray(struct.pack('<I', len(ops)))
+        for op, addr, value in ops:
+            msg += struct.pack('<BII', op, addr & 0xFFFFFFFF, value)
+        self.sock.sendall(msg)
+        status, n = struct.unpack('<BI', self._recv(5))
+        if status:
+            raise IOError("broker error: " + self._recv(n).decode())
+        return list(struct.unpack('<%dI' % n, self._recv(4*n)))
+
+    def read(self, addr):
+        return self._transact([ (RegisterBroker.OP_READ, addr, 0) ])[0]
+
+    def write(self, addr, value):
+        return self._transact([ (RegisterBroker.OP_WRITE, addr, value) ])[0]
+
+    def readmany(self, addrs):
+        return self._transact([ (RegisterBroker.OP_READ, addr, 0) for addr in addrs ])
+
+    def writemany(self, addrs, values):
+        return sum(self._transact([ (RegisterBroker.OP_WRITE, addr, value)
+                                    for addr, value in zip(addrs, values) ]))
+
+    def readblock(self, base, n, stride=4):
+        import numpy as np
+        return np.array(self.readmany(range(base, base+n*stride, stride)),
+                        dtype=np.uint32)
+
+    def writeblock(self, base, data, stride=4):
+        data = [ int(v) for v in data ]
+        return self.writemany(range(base, base+len(data)*stride, stride), data)
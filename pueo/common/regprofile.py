@@ -0,0 +1,267 @@
+import sys
+import os
+import time
+import threading
+import importlib
+import pkgutil
+
+from .dev_submod import dev_submod, _resolve_root
+
+# Opt-in register access profiler.
+#
+# >>> prof = RegisterProfiler()
+# >>> prof.attach(turf)
+# >>> prof.attach(tio)
+# >>> tio.cinalign.align_rxclk()
+# >>> prof.detach()
+# >>> prof.report()
+# >>> prof.write_folded('align.folded')   # feed to flamegraph.pl
+#
+# attach() wraps the read/write (and batched) callables on the
+# top-level device object AND on its transport (the TURF's cores
+# are built directly on the transport, and bridged TURFIO/SURF
+# cores resolve straight through to the TURF's transport). Nested
+# wrapped calls (a SURF access going through the TURFIO and then
+# the TURF) only get counted once, at the outermost one.
+#
+# Every access is attributed to the register property it came
+# from (e.g. PueoTURFEvent.ack_count) or, if it didn't come from
+# a property, to the innermost pueo method that made it. To get
+# property names the profiler temporarily swaps the properties on
+# every dev_submod class (and the attached device classes, importing
+# the cores in their package if they haven't been yet) for
+# wrapped ones - detach() puts them back.
+
+# pueo frames are anything under the package, these two are just
+# plumbing and are skipped when building stacks
+_PUEO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_FILES = ( os.path.abspath(__file__).rstrip('co'),
+                os.path.abspath(sys.modules[dev_submod.__module__].__file__).rstrip('co') )
+
+class _profiled_property(property):
+    """ property wrapper that tells the profiler which property is running """
+    pass
+
+
+class RegisterProfiler:
+    # latency histogram buckets are powers of 2 in microseconds
+    NBUCKETS = 32
+
+    # callables we wrap, and whether they're batched (and how to get
+    # the addresses out of the arguments)
+    WRAPPED = { 'read' : lambda a : [ a[0] ],
+                'write' : lambda a : [ a[0] ],
+                'writeto' : lambda a : [ a[0] ],
+                'readmany' : lambda a : list(a[0]),
+                'writemany' : lambda a : list(a[0]),
+                'readblock' : lambda a : [ a[0] + i*(a[2] if len(a) > 2 else 4) for i in range(a[1]) ],
+                'writeblock' : lambda a : [ a[0] + i*(a[2] if len(a) > 2 else 4) for i in range(len(a[1])) ] }
+
+    def __init__(self, folded=True):
+        self.folded = folded
+        self.local = threading.local()
+        self.clear()
+        # (object, name, saved instance attribute or None)
+        self._patched = []
+        # (class, name, original property)
+        self._props = []
+
+    def clear(self):
+        # (label, op, addr) -> [ count, bytes, total seconds, histogram ]
+        self.stats = {}
+        # folded stack -> [ count, total seconds ]
+        self.stacks = {}
+
+    def _state(self):
+        st = self.local
+        if not hasattr(st, 'depth'):
+            st.depth = 0
+            st.props = []
+        return st
+
+    # Attaching.
+    def attach(self, dev):
+        """ Instrument a PueoTURF/PueoTURFIO/PueoSURF (or any device). """
+        self._patch(dev)
+        # TURF cores talk to the transport directly
+        tdev = getattr(dev, 'dev', None)
+        if tdev is not None and not isinstance(tdev, dev_submod):
+            self._patch(tdev)
+        # and bridged TURFIOs/SURFs' cores go straight to the TURF's
+        root, offset = _resolve_root(dev)
+        if root is not dev:
+            self._patch(root)
+        self._wrap_properties(type(dev))
+        self._load_cores(type(dev))
+        for cls in self._subclasses(dev_submod):
+            self._wrap_properties(cls)
+
+    def detach(self):
+        """ Undo everything attach() did. Stats are kept. """
+        for obj, name, saved in reversed(self._patched):
+            if saved is None:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, saved)
+        self._patched = []
+        for cls, name, prop in reversed(self._props):
+            setattr(cls, name, prop)
+        self._props = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.detach()
+        return None
+
+    @staticmethod
+    def _load_cores(devcls):
+        # cores are only imported when they're first used, so make sure
+        # the ones in the device's package exist to get their properties
+        pkg = devcls.__module__.rpartition('.')[0]
+        if not pkg:
+            return
+        for m in pkgutil.iter_modules(sys.modules[pkg].__path__):
+            try:
+                importlib.import_module(pkg + '.' + m.name)
+            except Exception:
+                pass
+
+    @classmethod
+    def _subclasses(cls, c):
+        for s in c.__subclasses__():
+            yield s
+            yield from cls._subclasses(s)
+
+    def _patch(self, obj):
+        for name, addrfn in self.WRAPPED.items():
+            fn = getattr(obj, name, None)
+            if fn is None or any(p[0] is obj and p[1] == name for p in self._patched):
+                continue
+            saved = vars(obj).get(name) if hasattr(obj, '__dict__') else None
+            setattr(obj, name, self._wrap(fn, name, addrfn))
+            self._patched.append((obj, name, saved))
+
+    def _wrap_properties(self, cls):
+        for name, prop in list(vars(cls).items()):
+            if not isinstance(prop, property) or isinstance(prop, _profiled_property):
+                continue
+            label = cls.__name__ + '.' + name
+            fget = self._wrap_prop(prop.fget, label) if prop.fget else None
+            fset = self._wrap_prop(prop.fset, label) if prop.fset else None
+            setattr(cls, name, _profiled_property(fget, fset, prop.fdel, prop.__doc__))
+            self._props.append((cls, name, prop))
+
+    def _wrap_prop(self, fn, label):
+        def wrapped(*args):
+            st = self._state()
+            st.props.append(label)
+            try:
+                return fn(*args)
+            finally:
+                st.props.pop()
+        return wrapped
+
+    def _wrap(self, fn, op, addrfn):
+        def wrapped(*args):
+            st = self._state()
+            if st.depth:
+                return fn(*args)
+            st.depth += 1
+            start = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                dt = time.perf_counter() - start
+                st.depth -= 1
+                self._record(st, op, addrfn(args), dt)
+        return wrapped
+
+    # Recording.
+    def _stack(self):
+        """ pueo frames, outermost first, skipping the plumbing """
+        labels = []
+        f = sys._getframe(3)
+        while f is not None:
+            fn = f.f_code.co_filename
+            if fn.startswith(_PUEO_DIR) and fn not in _SKIP_FILES and f.f_code.co_name != '<lambda>':
+                obj = f.f_locals.get('self')
+                if obj is not None:
+                    labels.append(type(obj).__name__ + '.' + f.f_code.co_name)
+                else:
+                    labels.append(f.f_code.co_name)
+            f = f.f_back
+        labels.reverse()
+        return labels
+
+    def _record(self, st, op, addrs, dt):
+        stack = self._stack()
+        if st.props:
+            label = st.props[-1]
+            stack.append(label)
+        elif stack:
+            label = stack[-1]
+        else:
+            label = '<user>'
+        n = len(addrs)
+        if n == 0:
+            return
+        share = dt/n
+        bucket = min(int(share*1E6).bit_length(), self.NBUCKETS-1)
+        for addr in addrs:
+            key = (label, op, addr)
+            s = self.stats.get(key)
+            if s is None:
+                s = [ 0, 0, 0.0, [0]*self.NBUCKETS ]
+                self.stats[key] = s
+            s[0] += 1
+            s[1] += 4
+            s[2] += share
+            s[3][bucket] += 1
+        if self.folded:
+            fs = ';'.join(stack + [ '%s %s' % (op, hex(addrs[0])) ])
+            s = self.stacks.get(fs)
+            if s is None:
+                s = [ 0, 0.0 ]
+                self.stacks[fs] = s
+            s[0] += n
+            s[1] += dt
+
+    # Output.
+    def report(self, sort='time', top=40, file=None):
+        """
+        Print the busiest (label, op, address) entries. sort is
+        'time' or 'count'.
+        """
+        idx = 2 if sort == 'time' else 0
+        entries = sorted(self.stats.items(), key=lambda kv : kv[1][idx], reverse=True)
+        tcount = sum(s[0] for s in self.stats.values())
+        ttime = sum(s[2] for s in self.stats.values())
+        print(f'{tcount} accesses, {ttime*1E3:.1f} ms total', file=file)
+        print(f'{"count":>8} {"bytes":>9} {"total ms":>9} {"mean us":>8}  {"op":<10} {"addr":>10}  source', file=file)
+        for (label, op, addr), s in entries[:top]:
+            print(f'{s[0]:>8} {s[1]:>9} {s[2]*1E3:>9.2f} {s[2]*1E6/s[0]:>8.1f}  {op:<10} {addr:>#10x}  {label}', file=file)
+        return entries
+
+    def histogram(self, label=None, addr=None):
+        """
+        Combined latency histogram (counts per power-of-2 microsecond
+        bucket) for everything matching label and/or addr.
+        """
+        h = [0]*self.NBUCKETS
+        for (l, op, a), s in self.stats.items():
+            if (label is None or l == label) and (addr is None or a == addr):
+                h = [ x + y for x, y in zip(h, s[3]) ]
+        return h
+
+    def write_folded(self, path, weight='time'):
+        """
+        Write folded stacks (one 'frame;frame;frame weight' per line)
+        for flamegraph.pl/speedscope. weight is 'time' (microseconds)
+        or 'count'.
+        """
+        with open(path, 'w') as f:
+            for stack, s in sorted(self.stacks.items()):
+                w = s[0] if weight == 'count' else int(round(s[1]*1E6))
+                f.write(f'{stack} {w}\n')
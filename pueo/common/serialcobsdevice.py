@@ -323,22 +323,7 @@ class SerialCOBSDevice:
 
     # Multiread isn't necessarily supported for all addresses, be careful!
     def multiread(self, addr, num):
-            tx = bytearray(self.addrbytes + 1)
-            self.__buildaddr(tx, addr)
-            # kill the top bit
-            tx[0] = tx[0] & 0x7F
-            tx[self.addrbytes] = num - 1
-            # are we using addressing?
-            if self.address is not None:
-                    tx.insert(0, self.address)
-            toWrite = cobs.encode(tx)
-            # print(toWrite)
-            self.dev.write(toWrite)
-            self.dev.write(b'\x00')
-            # expect num+addr bytes back + 1 overhead + 1 framing
-            rx = self.dev.read(num + self.addrbytes + 2)
-            pk = cobs.decode(rx[:(num+self.addrbytes+2-1)])
-            return pk[self.addrbytes:]
+            return self.queued([ (addr, num) ])[0]
 
     def read(self, addr):
             pk = self.multiread(addr, 4)
@@ -349,11 +334,7 @@ class SerialCOBSDevice:
             return val
 
     def multiwrite(self, addr, data):
-            self.writeto(addr, data)
-            # expect addrbytes + 1 num + 1 overhead + 1 framing
-            rx = self.dev.read(self.addrbytes+3)
-            pk = cobs.decode(rx[:self.addrbytes+3-1])
-            return pk[self.addrbytes]
+            return self.queued([ (addr, data) ])[0]
 
     def write(self, addr, val):
             tx = bytearray(4)
@@ -363,8 +344,23 @@ class SerialCOBSDevice:
             tx[3] = (val & 0xFF000000)>>24
             return self.multiwrite(addr, tx)
 
-    # supes-dangerous, only do this if you KNOW there won't be a response
-    def writeto(self, addr, data):
+    # Frame builders. These return the complete COBS frame (with the
+    # trailing 0) plus the shortest reply it can get. COBS adds another
+    # overhead byte for every 254 bytes without a zero, so the actual
+    # reply can be longer.
+    def __readframe(self, addr, num):
+            tx = bytearray(self.addrbytes + 1)
+            self.__buildaddr(tx, addr)
+            # kill the top bit
+            tx[0] = tx[0] & 0x7F
+            tx[self.addrbytes] = num - 1
+            # are we using addressing?
+            if self.address is not None:
+                    tx.insert(0, self.address)
+            # expect num+addr bytes back + 1 overhead + 1 framing
+            return cobs.encode(tx) + b'\x00', num + self.addrbytes + 2
+
+    def __writeframe(self, addr, data):
             tx = bytearray(self.addrbytes)
             self.__buildaddr(tx, addr)
             # set top bit in addr for write
@@ -373,7 +369,79 @@ class SerialCOBSDevice:
             # are we using addressing?
             if self.address is not None:
                     tx.insert(0, self.address)
-            self.dev.write(cobs.encode(tx))
-            self.dev.write(b'\x00')
+            # expect addrbytes + 1 num + 1 overhead + 1 framing
+            return cobs.encode(tx) + b'\x00', self.addrbytes + 3
+
+    # Queued mode. Every access used to be write frame, wait for the
+    # reply, and over the FTDI every one of those waits eats a USB
+    # latency-timer tick. Instead this encodes up to QUEUE_DEPTH
+    # requests, sends them in ONE serial write, and reads all the
+    # replies back in (usually) ONE read. Replies come back in order,
+    # each ending in a 0, so they're split on the 0 delimiters: the
+    # shortest possible replies are read at once, then anything still
+    # missing is read up to its delimiter.
+    #
+    # ops is a list of (addr, num) for a multiread of num bytes or
+    # (addr, data) for a multiwrite of data. Returns a list of the
+    # multiread/multiwrite return values, in the same order.
+    # Same caveats as multiread: not every address supports it.
+    QUEUE_DEPTH = 32
+    def queued(self, ops):
+            ops = list(ops)
+            rv = []
+            for i in range(0, len(ops), self.QUEUE_DEPTH):
+                    frames = []
+                    for addr, data in ops[i:i+self.QUEUE_DEPTH]:
+                            if isinstance(data, int):
+                                    frames.append(self.__readframe(addr, data) + (True,))
+                            else:
+                                    frames.append(self.__writeframe(addr, data) + (False,))
+                    self.dev.write(b''.join(f[0] for f in frames))
+                    rx = bytes(self.dev.read(sum(f[1] for f in frames)))
+                    while rx.count(0) < len(frames):
+                            more = self.dev.read_until(b'\x00')
+                            if len(more) == 0 or more[-1] != 0:
+                                    raise IOError("COBS framing error: got %s" % (rx+more).hex())
+                            rx += more
+                    pkts = rx.split(b'\x00')[:len(frames)]
+                    for pkt, (frame, rxlen, isread) in zip(pkts, frames):
+                            if len(pkt) < rxlen-1:
+                                    raise IOError("COBS framing error: got %s" % pkt.hex())
+                            pk = cobs.decode(pkt)
+                            rv.append(pk[self.addrbytes:] if isread else pk[self.addrbytes])
+            return rv
+
+    def readmany(self, addrs):
+            return [ int.from_bytes(pk[0:4], 'little')
+                     for pk in self.queued([ (addr, 4) for addr in addrs ]) ]
+
+    def writemany(self, addrs, values):
+            rv = self.queued([ (addr, int(value).to_bytes(4, 'little'))
+                               for addr, value in zip(addrs, values) ])
+            return 4*len(rv)
+
+    # Contiguous blocks go through multiread, which can only do 256 bytes
+    # at a time. Same caveat as multiread: not all address spaces support it.
+    def readblock(self, base, n, stride=4):
+            import numpy as np
+            if stride != 4:
+                    return np.array(self.readmany(range(base, base+n*stride, stride)),
+                                    dtype=np.uint32)
+            ops = []
+            while n > 0:
+                    num = min(n, 64)
+                    ops.append((base, 4*num))
+                    base += 4*num
+                    n -= num
+            rb = b''.join(self.queued(ops))
+            return np.frombuffer(bytes(rb), dtype='<u4').astype(np.uint32)
+
+    def writeblock(self, base, data, stride=4):
+            data = [ int(v) for v in data ]
+            return self.writemany(range(base, base+len(data)*stride, stride), data)
+
+    # supes-dangerous, only do this if you KNOW there won't be a response
+    def writeto(self, addr, data):
+            self.dev.write(self.__writeframe(addr, data)[0])
 
 
@@ -2,41 +2,51 @@ import struct
 import sys
 import time
 from .hexfile import load as hexload
+from .dev_submod import wait_until
 from .bf import * 
 
-# let's prettify this
+# let's prettify this. The progress bar packages are only looked for
+# the first time a bar's needed (they're slow to import).
 pb2 = None
 ewidgets = None
 pwidgets = None
 make_bar = None
-try:
-    import progressbar2 as pb2
-    ewidgets = [ "Erasing: ",
-                " ", pb2.Percentage(),
-                " ", pb2.GranularBar(),
-                " ", pb2.AdaptiveETA() ]    
-    pwidgets = [ "Programming: ",
-                 " ", pb2.Percentage(),
-                 " ", pb2.GranularBar(),
-                 " ", pb2.AdaptiveETA() ]
-    make_bar = lambda x, w : pb2.ProgressBar(widgets=w, max_value=x, redirect_stdout=True)
-except ImportError:
-    pass
+_pb_searched = False
 
-if pb2 is None:
+def _find_progressbar():
+    global pb2, ewidgets, pwidgets, make_bar, _pb_searched
+    if _pb_searched:
+        return pb2
+    _pb_searched = True
     try:
-        import progressbar as pb2
+        import progressbar2 as pb2
         ewidgets = [ "Erasing: ",
-                     " ", pb2.Percentage(),
-                     " ", pb2.Bar(),
-                     " ", pb2.AdaptiveETA() ]    
+                    " ", pb2.Percentage(),
+                    " ", pb2.GranularBar(),
+                    " ", pb2.AdaptiveETA() ]    
         pwidgets = [ "Programming: ",
                      " ", pb2.Percentage(),
-                     " ", pb2.Bar(),
+                     " ", pb2.GranularBar(),
                      " ", pb2.AdaptiveETA() ]
-        make_bar = lambda x, w : pb2.ProgressBar(widgets=w, maxval=x)
+        make_bar = lambda x, w : pb2.ProgressBar(widgets=w, max_value=x, redirect_stdout=True)
     except ImportError:
-        pass    
+        pass
+
+    if pb2 is None:
+        try:
+            import progressbar as pb2
+            ewidgets = [ "Erasing: ",
+                         " ", pb2.Percentage(),
+                         " ", pb2.Bar(),
+                         " ", pb2.AdaptiveETA() ]    
+            pwidgets = [ "Programming: ",
+                         " ", pb2.Percentage(),
+                         " ", pb2.Bar(),
+                         " ", pb2.AdaptiveETA() ]
+            make_bar = lambda x, w : pb2.ProgressBar(widgets=w, maxval=x)
+        except ImportError:
+            pass
+    return pb2
     
 # This pulls out the SPI flash stuff from the old spi.py.
 class SPIFlash:
@@ -197,7 +207,7 @@ class SPIFlash:
                     sector_list.append(end_sector)
                 end_sector = end_sector + 1
         # prep the erasebar
-        if pb2:
+        if _find_progressbar():
             erasebar = make_bar(len(sector_list), ewidgets).start()
             update = lambda v, n : erasebar.update(v)
             finish = erasebar.finish
@@ -219,7 +229,7 @@ class SPIFlash:
             start = seg.start_address
             end = 0
             tot = 0
-            if pb2:
+            if _find_progressbar():
                 progbar = make_bar(seg.size, pwidgets).start()
                 update = lambda s, e, t : progbar.update(t)
                 finish = progbar.finish
@@ -266,10 +276,9 @@ class SPIFlash:
             print("START TIMED OUT!!")
             self.write_disable()
             return
-        trials = 0
-        while res & 0x1:
-            res = self.status()
-            trials = trials + 1
+        if wait_until(self.status, lambda r : not (r & 0x1),
+                      timeout=1.0, name='SPIFlash page program') is None:
+            print("PAGE PROGRAM TIMED OUT!!")
 
     def erase(self, address):
         self.write_enable()
@@ -309,11 +318,12 @@ class SPIFlash:
             self.write_disable()
             return
         print("Erase started. Waiting for erase complete...")
-        trials = 0
-        while res & 0x1:
-            res = self.status()
-            trials = trials + 1
-        print("Erase complete after %d trials." % trials)
+        start = time.perf_counter()
+        if wait_until(self.status, lambda r : not (r & 0x1),
+                      timeout=10.0, strategy='sleep', name='SPIFlash erase') is None:
+            print("ERASE TIMED OUT!!")
+            return
+        print("Erase complete after %.1f ms." % ((time.perf_counter()-start)*1E3))
 
     def write_bank_address(self, bank):
         if self.memory_capacity > 2**24:
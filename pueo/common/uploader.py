@@ -1,35 +1,48 @@
-from .bf import bf
+from .bf import field
+from .dev_submod import poll_until_multi
 import struct
 import os
 from hashlib import md5
 
+# The progress bar packages are only looked for the first time a
+# bar's needed (they're slow to import).
 pb2 = None
 uwidgets = None
 make_bar = None
-try:
-    import progressbar2 as pb2
-    uwidgets = [ "Uploading: ",
-                 " ", pb2.Percentage(),
-                 " ", pb2.GranularBar(),
-                 " ", pb2.AdaptiveETA() ]
-    make_bar = lambda x, w : pb2.ProgressBar(widgets=w, max_value=x, redirect_stdout=True)
-except ImportError:
-    pass
+_pb_searched = False
 
-if pb2 is None:
+def _find_progressbar():
+    global pb2, uwidgets, make_bar, _pb_searched
+    if _pb_searched:
+        return pb2
+    _pb_searched = True
     try:
-        import progressbar as pb2
+        import progressbar2 as pb2
         uwidgets = [ "Uploading: ",
                      " ", pb2.Percentage(),
-                     " ", pb2.Bar(),
+                     " ", pb2.GranularBar(),
                      " ", pb2.AdaptiveETA() ]
-        make_bar = lambda x, w : pb2.ProgressBar(widgets=w, maxval=x)
+        make_bar = lambda x, w : pb2.ProgressBar(widgets=w, max_value=x, redirect_stdout=True)
     except ImportError:
         pass
+
+    if pb2 is None:
+        try:
+            import progressbar as pb2
+            uwidgets = [ "Uploading: ",
+                         " ", pb2.Percentage(),
+                         " ", pb2.Bar(),
+                         " ", pb2.AdaptiveETA() ]
+            make_bar = lambda x, w : pb2.ProgressBar(widgets=w, maxval=x)
+        except ImportError:
+            pass
+    return pb2
     
 
 class Uploader:
     BANKLEN = 49152
+    # bank ready flags in the SURF's CTRLSTAT
+    BANK_READY = ( field(14), field(15) )
     
     """
     Handles the upload logic for interacting with SURFs.
@@ -46,6 +59,15 @@ class Uploader:
         self.fwupd = fwupd_func
         self.mark = mark_func
 
+    def wait_bank_ready(self, surf, bank, timeout=10.0):
+        """ Wait for bank to be free on all of the SURFs at once """
+        ready = self.BANK_READY[bank]
+        r = poll_until_multi([ (s, 0xC, ready.smask, ready.smask) for s in surf ],
+                             timeout, name='Uploader bank ready')
+        if None in r:
+            raise IOError("bank %d never became ready on %s" %
+                          (bank, [ s for s, v in zip(surf, r) if v is None ]))
+
     @staticmethod
     def hash_bytestr_iter(bytesiter, hasher, ashexstr=False):
         for block in bytesiter:
@@ -117,7 +139,7 @@ class Uploader:
         d = hdr
         written = 0
 
-        if pb2:
+        if _find_progressbar():
             uploadbar = make_bar(flen, uwidgets).start()
             update = lambda v, n : uploadbar.update(v)
             finish = uploadbar.finish
@@ -136,11 +158,7 @@ class Uploader:
                 fmt = ">%dI" % (len(d) // 4)
                 il = struct.unpack(fmt, d)
                 # check to see if that bank is ready
-                testIdx = bank + 14
-                for s in surf:
-                    rv = bf(s.read(0xC))
-                    while not rv[testIdx]:
-                        rv = bf(s.read(0xC))
+                self.wait_bank_ready(surf, bank)
                 for val in il:
                     self.fwupd(val)
                 self.mark(bank)
@@ -184,7 +202,7 @@ class Uploader:
         d = hdr
         written = 0
 
-        if pb2:
+        if _find_progressbar():
             uploadbar = make_bar(flen, uwidgets).start()
             update = lambda v, n : uploadbar.update(v)
             finish = uploadbar.finish
@@ -203,11 +221,7 @@ class Uploader:
                 fmt = ">%dI" % (len(d) // 4)
                 il = struct.unpack(fmt, d)
                 # check to see if that bank is ready
-                testIdx = bank + 14
-                for s in surf:
-                    rv = bf(s.read(0xC))
-                    while not rv[testIdx]:
-                        rv = bf(s.read(0xC))
+                self.wait_bank_ready(surf, bank)
                 for val in il:
                     self.fwupd(val)
                 self.mark(bank)
@@ -1,4 +1,5 @@
 from .bf import bf
+from .dev_submod import wait_until
 
 class USPEyeScan:
     """
@@ -170,6 +171,13 @@ class USPEyeScan:
         """ returns zero if not complete, nonzero if complete """
         return self.read(0x253) & 0x1
 
+    def wait_complete(self, timeout=30.0):
+        """ wait for the eyescan to finish: False if it never did """
+        if wait_until(self.complete, bool, timeout, name=f'{self.name} eyescan') is None:
+            print(self.name, ": Eye scan never completed!")
+            return False
+        return True
+
     def results(self):
         """ get results from complete eye scan and move to reset """
         ev = (self.read(0x251), self.read(0x252))
@@ -221,8 +229,8 @@ class USPEyeScan:
         ntrials = 0
         while ntrials < 1000:
             self.start()
-            while not self.complete():
-                pass
+            if not self.wait_complete():
+                return False
             ev = self.results()
             if ev[0] == 0:
                 break
@@ -1,15 +1,27 @@
 import spi
 from pathlib import Path
+import ctypes
+import fcntl
+import struct
 
 # to autofind: call with WBSPI(WBSPI.find_device(compat_str)) where
 # compat_str is the compatibility string in the device tree
 # this assumes a 32-bit space with 22-bit byte addressing (20 real bits)
 class WBSPI(spi.SPI):
+    # spidev's default buffer is 4096 bytes, and each register is
+    # 7 bytes each way
+    MAX_BATCH = 256
+    TXN_LEN = 7
+    # candidate clocks for autotune(), slowest first
+    SPEEDS = [ 5000000, 10000000, 12500000, 16666666, 20000000,
+               25000000, 33333333, 40000000, 50000000 ]
+
     def __init__(self, path='/dev/spidev2.0', speed=10000000):
         super().__init__(path)
         self.mode = self.MODE_0
         self.bits_per_word = 8
-        self.speed = 10000000
+        self.speed = speed
+        self._xfer = struct.Struct(self._IOC_TRANSFER_FORMAT)
 
     def read(self, address):
         txn = self._buildtxn(address)
@@ -21,6 +33,80 @@ class WBSPI(spi.SPI):
         txn = self._buildtxn(address, value, mask)
         self.transfer(txn)
 
+    # Batches go out as ONE SPI_IOC_MESSAGE(n) ioctl: one
+    # spi_ioc_transfer per register, with cs_change set on all but
+    # the last so CS still cycles between registers.
+    def _message(self, txns):
+        n = len(txns)
+        tx = ctypes.create_string_buffer(b''.join(txns), n*self.TXN_LEN)
+        rx = ctypes.create_string_buffer(n*self.TXN_LEN)
+        txp = ctypes.addressof(tx)
+        rxp = ctypes.addressof(rx)
+        xfers = bytearray()
+        for i in range(n):
+            o = i*self.TXN_LEN
+            xfers += self._xfer.pack(txp+o, rxp+o, self.TXN_LEN,
+                                     0, 0, 0, 1 if i < n-1 else 0,
+                                     0, 0, 0)
+        # SPI_IOC_MESSAGE(n): the size field is the whole array
+        op = self._IOC_MESSAGE + (((n-1)*self._xfer.size) << 16)
+        # needs to be a mutable buffer, or fcntl limits it to 1024 bytes
+        fcntl.ioctl(self.handle, op, xfers, True)
+        return rx.raw
+
+    def readmany(self, addrs):
+        txns = []
+        for addr in addrs:
+            txn = self._buildtxn(addr)
+            txn[2] |= 0x8
+            txns.append(bytes(txn))
+        rv = []
+        for i in range(0, len(txns), self.MAX_BATCH):
+            rx = self._message(txns[i:i+self.MAX_BATCH])
+            rv += [ int.from_bytes(rx[o+3:o+7], 'big')
+                    for o in range(0, len(rx), self.TXN_LEN) ]
+        return rv
+
+    def writemany(self, addrs, values):
+        txns = [ bytes(self._buildtxn(addr, int(value)))
+                 for addr, value in zip(addrs, values) ]
+        for i in range(0, len(txns), self.MAX_BATCH):
+            self._message(txns[i:i+self.MAX_BATCH])
+
+    def readblock(self, base, n, stride=4):
+        import numpy as np
+        return np.array(self.readmany(range(base, base+n*stride, stride)),
+                        dtype=np.uint32)
+
+    def writeblock(self, base, data, stride=4):
+        data = [ int(v) for v in data ]
+        self.writemany(range(base, base+len(data)*stride, stride), data)
+
+    def autotune(self, address=0x0, ntries=256, margin=1, verbose=True):
+        """
+        Find the fastest clock in SPEEDS that reads address back
+        correctly ntries times in a row (batched, so this is quick),
+        then back off by margin steps and use that. The expected value
+        is read at the slowest speed first. Returns the speed chosen.
+        """
+        self.speed = self.SPEEDS[0]
+        expected = self.read(address)
+        good = []
+        for speed in self.SPEEDS:
+            self.speed = speed
+            if any(v != expected for v in self.readmany([address]*ntries)):
+                if verbose:
+                    print("WBSPI: failed at", speed, "Hz")
+                break
+            good.append(speed)
+        if not good:
+            self.speed = self.SPEEDS[0]
+            raise IOError("WBSPI: no working speed found")
+        self.speed = good[max(len(good)-1-margin, 0)]
+        if verbose:
+            print("WBSPI: using", self.speed, "Hz")
+        return self.speed
+
     @staticmethod
     def _buildtxn(address, data=0, mask=0):
         address = (((address & 0x3FFFFF) >> 2) << 4 | ((mask & 0x3) << 1))
@@ -0,0 +1,197 @@
+import socket
+import selectors
+import threading
+import heapq
+import random
+import time
+
+# Hardware-free TURF register emulator.
+#
+# This speaks the TURF register protocol on the read/write ports:
+# requests are a little-endian 32-bit address word (top 4 bits are
+# the tag) plus a little-endian 32-bit value for writes, and every
+# reply is the request's address word (so the tag is echoed) followed
+# by the little-endian value. Register 0 is the ID register, which is
+# what EthDevice reads with tag 0 when it opens.
+#
+# The register file is pluggable: anything with read(addr) and
+# write(addr, value) works. Latency, jitter and packet loss are
+# applied per request, so with jitter replies can come back out of
+# order, same as they can through a switch.
+#
+# >>> emu = TURFEmulator('127.0.0.1', latency=100E-6, jitter=20E-6)
+# >>> emu.start()
+# >>> dev = EthDevice('127.0.0.1', local_ip='127.0.0.1', local_port=0)
+# >>> TURFEmulator.benchmark(dev)
+
+class TURFRegisters:
+    """ Default register file: a dict, preloaded with ID/DateVersion """
+    def __init__(self, regs=None):
+        self.regs = { 0x0 : 0x54555246,  # 'TURF'
+                      0x4 : 0x00000000 }
+        if regs is not None:
+            self.regs.update(regs)
+
+    def read(self, addr):
+        return self.regs.get(addr, 0)
+
+    def write(self, addr, value):
+        self.regs[addr] = value
+
+
+class TURFEmulator:
+    UDP_RD = 21618
+    UDP_WR = 21623
+
+    def __init__(self,
+                 ip = "127.0.0.1",
+                 read_port = UDP_RD,
+                 write_port = UDP_WR,
+                 regs = None,
+                 latency = 0.0,
+                 jitter = 0.0,
+                 loss = 0.0,
+                 seed = None):
+        self.ip = ip
+        self.read_port = read_port
+        self.write_port = write_port
+        self.regs = regs if regs is not None else TURFRegisters()
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.random = random.Random(seed)
+
+        self.nread = 0
+        self.nwrite = 0
+        self.ndropped = 0
+
+        self.rsock = None
+        self.wsock = None
+        self.thread = None
+        self.running = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.stop()
+        return None
+
+    def start(self):
+        self.rsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.rsock.bind((self.ip, self.read_port))
+        self.wsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.wsock.bind((self.ip, self.write_port))
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.rsock.close()
+        self.wsock.close()
+
+    def _delay(self):
+        d = self.latency
+        if self.jitter:
+            d += self.random.uniform(-self.jitter, self.jitter)
+        return max(d, 0.0)
+
+    def _handle(self, sock, data, write):
+        if len(data) < (8 if write else 4):
+            return None
+        if self.loss and self.random.random() < self.loss:
+            self.ndropped += 1
+            return None
+        aw = int.from_bytes(data[0:4], 'little')
+        addr = aw & 0xFFFFFFF
+        if write:
+            value = int.from_bytes(data[4:8], 'little')
+            self.regs.write(addr, value)
+            self.nwrite += 1
+        else:
+            value = self.regs.read(addr) & 0xFFFFFFFF
+            self.nread += 1
+        return data[0:4] + value.to_bytes(4, 'little')
+
+    def _run(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self.rsock, selectors.EVENT_READ, False)
+        sel.register(self.wsock, selectors.EVENT_READ, True)
+        # replies waiting for their latency to expire:
+        # (send time, sequence, socket, reply, address)
+        queue = []
+        seq = 0
+        while self.running:
+            now = time.perf_counter()
+            while queue and queue[0][0] <= now:
+                t, n, sock, resp, addr = heapq.heappop(queue)
+                sock.sendto(resp, addr)
+            timeout = 0.05
+            if queue:
+                timeout = min(timeout, max(queue[0][0] - now, 0))
+            for key, mask in sel.select(timeout):
+                sock = key.fileobj
+                data, addr = sock.recvfrom(1024)
+                resp = self._handle(sock, data, key.data)
+                if resp is None:
+                    continue
+                delay = self._delay()
+                if delay == 0:
+                    sock.sendto(resp, addr)
+                else:
+                    heapq.heappush(queue, (time.perf_counter() + delay, seq, sock, resp, addr))
+                    seq += 1
+        sel.close()
+
+    @staticmethod
+    def benchmark(dev, n=1000, addr=0x0):
+        """
+        Time n single reads and one n-long readmany on dev.
+        Returns transactions per second for each.
+        """
+        r = {}
+        start = time.perf_counter()
+        for i in range(n):
+            dev.read(addr)
+        r['read'] = n/(time.perf_counter() - start)
+        if hasattr(dev, 'readmany'):
+            start = time.perf_counter()
+            dev.readmany([addr]*n)
+            r['readmany'] = n/(time.perf_counter() - start)
+        for k in r:
+            print(f'{k}: {r[k]:.0f} transactions/s')
+        return r
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ip", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--latency", type=float, default=0.0, help="reply latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="reply jitter in seconds")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of requests dropped")
+    parser.add_argument("--bench", type=int, default=0,
+                        help="run an EthDevice benchmark with this many transactions, then exit")
+    args = parser.parse_args()
+
+    emu = TURFEmulator(args.ip, latency=args.latency, jitter=args.jitter, loss=args.loss)
+    emu.start()
+    if args.bench:
+        from pueo.common.ethdevice import EthDevice
+        dev = EthDevice(args.ip, local_ip=args.ip, local_port=0)
+        TURFEmulator.benchmark(dev, args.bench)
+        dev.close()
+        emu.stop()
+    else:
+        print(f'Emulating TURF on {args.ip}:{emu.read_port}/{emu.write_port}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            emu.stop()
@@ -6,20 +6,17 @@
 # direct serial (to be deprecated), SPI, or TURFIO
 # bridged (which itself can be TURF bridged).
 
-from ..common.serialcobsdevice import SerialCOBSDevice
 from ..common import pueo_utils
-from ..common.bf import bf
+from ..common.bf import field
 from ..common.dev_submod import dev_submod, bitfield, bitfield_ro, register, register_ro
+from ..common.dev_submod import shadow_annotate, shadow_invalidate, shadow_write, shadow_rmw, transaction, snapshot, poll_until
 
 from enum import Enum
+from functools import cached_property
 import time
 import os
 
-try:
-    from pyrfdc import PyRFDC
-    have_pyrfdc = True
-except ImportError:
-    have_pyrfdc = False
+# pyrfdc is only looked for when the rfdc is first used (see rfdc)
 
 class PueoSURF:
     class DateVersion:
@@ -66,29 +63,57 @@ class PueoSURF:
             'TIOPDLYCNTB' : 0x884,
             'TIOMDLYCNTA' : 0x888,
             'TIOMDLYCNTB' : 0x88C}
+
+    # Control bits in TIOCTRL: CIN/VTC/IDELAYCTRL/MMCM resets, train
+    # enable, lock request, PLL reset and the RXCLK phase.
+    shadow = { 0x800 : 0x7FFF2857 }
+    # bitslip reset/bitslip are flags (see turfioSetOffset), 31/15/12/7/5/3
+    # are status. Bits 14 and 10 aren't either, so setters still read.
+    shadow_flags = { 0x800 : 0x800093A8 }
+    # TIOCTRL bits that get poked directly
+    TIO_BITSLIP_RST = field(8)
+    TIO_BITSLIP = field(9)
+    TIO_PLL_RESET = field(13)
+    TIO_MISALIGNED = field(15)
         
     def __init__(self,
                  accessInfo,
                  type=AccessType.SERIAL,
-                 param_file='/usr/local/share/rfdc_gen3.pkl'):
+                 param_file='/usr/local/share/rfdc_gen3.pkl',
+                 attach=False):
+        # attach=True just connects: no writes, no sleeps, and the
+        # RFdc doesn't get configured.
+        self.attach = attach
         if type == self.AccessType.SPI:
             from ..common.wbspi import WBSPI            
             self.dev = WBSPI(path=accessInfo,
                              speed=10000000)
+            self.devpath = f'spi:{accessInfo}'
             self.read = self.dev.read
-            self.write = self.dev.write                             
+            self.write = self.dev.write
+            self.readmany = self.dev.readmany
+            self.writemany = self.dev.writemany
+            self.readblock = self.dev.readblock
+            self.writeblock = self.dev.writeblock
         elif type == self.AccessType.SERIAL:
             # need to think about a way to spec the address here?
+            from ..common.serialcobsdevice import SerialCOBSDevice
             self.dev = SerialCOBSDevice(accessInfo,
                                         baudrate=1000000,
                                         addrbytes=3,
                                         devAddress=0)
+            self.devpath = f'serial:{accessInfo}'
             self.reset = self.dev.reset
             self.read = self.dev.read
             self.write = self.dev.write
             self.writeto = self.dev.writeto
+            self.readmany = self.dev.readmany
+            self.writemany = self.dev.writemany
+            self.readblock = self.dev.readblock
+            self.writeblock = self.dev.writeblock
 
-            self.reset()
+            if not attach:
+                self.reset()
         elif type == self.AccessType.TURFIO:
             turfio = accessInfo[0]
             slot = accessInfo[1]
@@ -98,35 +123,54 @@ class PueoSURF:
             if r & (1<<slot):
                 raise Exception(f'RXCLK is off on SURF slot {slot}: {hex(r)}')
             self.dev = turfio.surfbridge[slot]
-            self.read = self.dev.read
-            self.write = self.dev.write
+            self.devpath = None if turfio.devpath is None else f'{turfio.devpath}/surf{slot}'
+            # see through the SURF bridge (and the TURFIO, if it's
+            # going through the TURF) straight to the transport
+            self._resolve = self.dev._resolve
+            self.addrspace = self.dev.addrspace
+            root, offset = self._resolve()
+            self.read = lambda addr : root.read(addr + offset)
+            self.write = lambda addr, value : root.write(addr + offset, value)
+            self.readmany = self.dev.readmany
+            self.writemany = self.dev.writemany
+            self.readblock = self.dev.readblock
+            self.writeblock = self.dev.writeblock
             # CRAP I MIGHT NEED TO IMPLEMENT WRITETO OR SOMETHING??
         else:
             raise Exception("type must be one of",
                             [e.value for e in self.AccessType])
 
+        shadow_annotate(self, self.shadow, self.shadow_flags)
         self.rfdc_param_file = param_file
         
         # clock monitor calibration
         self.clockMonValue = 100000000
-        self.write(self.map['ACLKMON'], self.clockMonValue)
+        if not attach:
+            self.write(self.map['ACLKMON'], self.clockMonValue)
+            time.sleep(0.1)
 
-        # add the rfdc
-        # note that libunivrfdc must be in your LD_LIBRARY_PATH!!
-        if have_pyrfdc:
+    # add the rfdc, the first time it's used.
+    # note that libunivrfdc must be in your LD_LIBRARY_PATH!!
+    @cached_property
+    def rfdc(self):
+        try:
+            from pyrfdc import PyRFDC
+        except ImportError:
+            PyRFDC = None
+        if PyRFDC is not None:
             try:                
-                self.rfdc = PyRFDC(dev_submod(self, 0x200000),
-                                   self.rfdc_param_file)
-                self.rfdc.configure()
+                rfdc = PyRFDC(dev_submod(self, 0x200000),
+                              self.rfdc_param_file)
+                if not self.attach:
+                    rfdc.configure()
+                return rfdc
             except Exception as e:
                 print(f'Exception {repr(e)} creating PyRFDC: just using dev_submod')
-                self.rfdc = dev_submod(self, 0x200000)
-        else:
-            self.rfdc = dev_submod(self, 0x200000)
+        return dev_submod(self, 0x200000)
 
-        self.levelone = dev_submod(self, 0x008000)
-            
-        time.sleep(0.1)        
+    @cached_property
+    def levelone(self):
+        return dev_submod(self, 0x008000)
 
 ################################################################################################################
 # REGISTER SPACE                                                                                               #
@@ -160,9 +204,7 @@ class PueoSURF:
 
     @turfio_lock_req.setter
     def turfio_lock_req(self, value):
-        r = bf(self.read(0x800))
-        r[11] = 1 if value else 0
-        self.write(0x800, int(r))
+        shadow_rmw(self, 0x800, 11, 0x1, 1 if value else 0)
 
     @property
     def turfio_locked_or_running(self):
@@ -176,7 +218,7 @@ class PueoSURF:
     @turfio_cin_active.setter
     def turfio_cin_active(self, value):
         r = self.read(0x800) & ~0x80
-        self.write(0x800, r)
+        shadow_write(self, 0x800, r)
     
     @property
     def turfio_train_enable(self):
@@ -184,23 +226,30 @@ class PueoSURF:
 
     @turfio_train_enable.setter
     def turfio_train_enable(self, value):
-        r = bf(self.read(0x800))
-        r[6] = 1 if value else 0
-        self.write(0x800, int(r))
+        shadow_rmw(self, 0x800, 6, 0x1, 1 if value else 0)
 
     @property
     def hsk_packet_count(self):
         """ not what you think, doesn't work yet """
         return self.read(0x10) & 0xF
 
-    def dna(self):
-        self.write(self.map['DNA'], 0x80000000)
-        dnaval=0
-        for i in range(57):
-            r = self.read(self.map['DNA'])
-            val = r & 0x1
-            dnaval = (dnaval << 1) | val
-        return dnaval
+    def transaction(self):
+        """ Queue and merge writes until the with block exits (see dev_submod.transaction) """
+        return transaction(self)
+
+    def snapshot(self, fields=None, record=False):
+        """ Read all (or the named) register fields at once (see dev_submod.snapshot) """
+        return snapshot(self, fields, record)
+
+    def poll_until(self, addr, mask, value, timeout=1.0, strategy='backoff', name=None):
+        """ Wait for (read(addr) & mask) == value (see dev_submod.poll_until) """
+        return poll_until(self, addr, mask, value, timeout, strategy, name)
+
+    def dna(self, refresh=False):
+        """ Device DNA, from the on-disk cache if we've seen this device/firmware before """
+        return pueo_utils.cached_dna(self, self.devpath,
+                                     self.read(self.map['FPGA_DATEVERSION']),
+                                     self.map['DNA'], refresh)
 
     def identify(self, verbose=True):
         def str4(num):
@@ -227,13 +276,9 @@ class PueoSURF:
             
     def status(self, verbose=True):
         id_dict = self.identify(verbose)
-        d = {}
-        d['ACLK'] = self.read(self.map['ACLKMON'])
-        d['GTPCLK'] = self.read(self.map['GTPCLKMON'])
-        d['RXCLK'] = self.read(self.map['RXCLKMON'])
-        d['CLK300'] = self.read(self.map['CLK300MON'])
-        d['IFCLK'] = self.read(self.map['IFCLKMON'])
-        d['RACKCLK']= self.read(self.map['RACKCLKMON'])
+        # clock monitors are contiguous from ACLKMON to RACKCLKMON
+        clks = [ 'ACLK', 'GTPCLK', 'RXCLK', 'CLK300', 'IFCLK', 'RACKCLK' ]
+        d = dict(zip(clks, self.readblock(self.map['ACLKMON'], len(clks)).tolist()))
         if verbose:
             for k in d.keys():
                 print(f'{k}: {d[k]}')
@@ -254,16 +299,8 @@ class PueoSURF:
         if phaseValue > 671:
             print("phaseValue must be less than 672!")
             return
-        r = bf(self.read(self.map['TIOCTRL']))
-        r[30:16] = phaseValue
-        self.write(self.map['TIOCTRL'], int(r))
-        ntrials = 100
-        while ntrials > 0:
-            if self.read(self.map['TIOCTRL']) & (1<<31):
-                ntrials = ntrials - 1
-            else:
-                break
-        if ntrials == 0:
+        shadow_rmw(self, self.map['TIOCTRL'], 16, 0x7FFF, phaseValue)
+        if self.poll_until(self.map['TIOCTRL'], 1<<31, 0, timeout=0.1, name='PueoSURF.rxclkShift') is None:
             print("IDELAYCTRL never became ready?!?")
             return
         
@@ -275,9 +312,11 @@ class PueoSURF:
     # After we find the eye, we have to align IFCLK
     # to RXCLK as well. We do that by forcibly
     # resetting the PLL until it aligns properly.
-    def align_rxclk(self, userSkew=None, verbose=False, eyeNumber=0):        
+    # stride is passed to eyescan_rxclk: the default (None) does the
+    # full sweep, stride=16 or so opts in to the adaptive search.
+    def align_rxclk(self, userSkew=None, verbose=False, eyeNumber=0, stride=None):
         if userSkew is None:
-            sc = self.eyescan_rxclk()
+            sc = self.eyescan_rxclk(stride=stride)
             eyes = self.process_eyescan(sc)
             if len(sc) == 0:
                 if verbose:
@@ -306,17 +345,16 @@ class PueoSURF:
             skew = (shift/672)*8
         else:
             self.rxclkShift(round(userSkew*672/8))
+            skew = userSkew
         # Now we need to check the alignment
-        r = bf(self.read(self.map['TIOCTRL']))
+        r = self.read(self.map['TIOCTRL'])
         nreset = 0
-        while r[15]:
+        while self.TIO_MISALIGNED.get(r):
             if verbose:
                 print("IFCLK/RXCLK are misaligned, resetting PLLs")
-            r[13] = 1
-            self.write(self.map['TIOCTRL'], int(r))
-            r[13] = 0
-            self.write(self.map['TIOCTRL'], int(r))
-            r = bf(self.read(self.map['TIOCTRL']))
+            shadow_write(self, self.map['TIOCTRL'], self.TIO_PLL_RESET.set(r, 1))
+            shadow_write(self, self.map['TIOCTRL'], self.TIO_PLL_RESET.set(r, 0))
+            r = self.read(self.map['TIOCTRL'])
             nreset = nreset + 1
         if verbose:
             print("RXCLK alignment complete after", nreset,
@@ -324,16 +362,25 @@ class PueoSURF:
             "skew:", skew)
         return skew     
     
-    def eyescan_rxclk(self, period=1024):
+    # set a previously found skew (e.g. from an AlignCache) and check it once
+    def try_rxclk(self, skew, period=1024):
+        self.align_rxclk(userSkew=skew)
+        self.write(self.map['TIORXERR'], period)
+        time.sleep(period*10E-9)
+        return self.read(self.map['TIORXERR']) == 0
+
+    # stride=None samples all 672 phases, otherwise it's an adaptive
+    # search (see pueo_utils.adaptive_eyescan) which gives the same eyes
+    # from process_eyescan in a few dozen samples.
+    def eyescan_rxclk(self, period=1024, stride=None):
         slptime = period*10E-9
-        sc = []
         self.rxclkShift(0)
         self.write(self.map['TIORXERR'], period)
-        for i in range(672):
+        def sample(i):
             self.rxclkShift(i)
             time.sleep(slptime)
-            sc.append(self.read(self.map['TIORXERR']))
-        return sc
+            return self.read(self.map['TIORXERR'])
+        return pueo_utils.adaptive_eyescan(sample, 672, stride)
             
     @staticmethod
     def process_eyescan(scan, width=672, wraparound=True):
@@ -371,6 +418,8 @@ class PueoSURF:
         return eyes
         
     def turfioReset(self):
+        # start from what's actually in the register
+        shadow_invalidate(self, self.map['TIOCTRL'])
         # reset shift just to be careful
         # later firmware does this automatically on MMCM reset
         self.rxclkShift(0)
@@ -383,13 +432,7 @@ class PueoSURF:
         # release MMCM
         self.mmcmReset(False)
         # wait to become ready
-        ntrials = 100
-        while ntrials > 0:
-            if self.read(self.map['TIOCTRL']) & (1<<5):
-                break
-            else:
-                ntrials = ntrials - 1
-        if ntrials == 0:
+        if self.poll_until(self.map['TIOCTRL'], 1<<5, 1<<5, timeout=0.1, name='PueoSURF MMCM ready') is None:
             print("MMCM never became ready?!?")
             return
         # release CIN
@@ -397,37 +440,24 @@ class PueoSURF:
         # release IDELAYCTRL
         self.idelayctrlReset(False)
         # wait for ready
-        ntrials = 100
-        while ntrials > 0:
-            if self.read(self.map['TIOCTRL']) & (1<<3):
-                break
-            else:
-                ntrials = ntrials - 1
-        if ntrials == 0:
+        if self.poll_until(self.map['TIOCTRL'], 1<<3, 1<<3, timeout=0.1, name='PueoSURF IDELAYCTRL ready') is None:
             print("IDELAYCTRL never became ready?!?")
             return
         # done
         
+    # TIOCTRL is shadowed, so these are just writes
     def mmcmReset(self, enable):
-        r = bf(self.read(self.map['TIOCTRL']))
-        r[4] = 1 if enable else 0
-        self.write(self.map['TIOCTRL'], int(r))
+        shadow_rmw(self, self.map['TIOCTRL'], 4, 0x1, 1 if enable else 0)
         
     def idelayctrlReset(self, enable):
-        r = bf(self.read(self.map['TIOCTRL']))
-        r[2] = 1 if enable else 0
-        self.write(self.map['TIOCTRL'], int(r))
+        shadow_rmw(self, self.map['TIOCTRL'], 2, 0x1, 1 if enable else 0)
         
     def cinReset(self, enable):
-        r = bf(self.read(self.map['TIOCTRL']))
-        r[0] = 1 if enable else 0
-        self.write(self.map['TIOCTRL'], int(r))
+        shadow_rmw(self, self.map['TIOCTRL'], 0, 0x1, 1 if enable else 0)
     
     def vtc(self, enable):
         # this is a DISABLE bit
-        r = bf(self.read(self.map['TIOCTRL']))
-        r[1] = 0 if enable else 1
-        self.write(self.map['TIOCTRL'], int(r))
+        shadow_rmw(self, self.map['TIOCTRL'], 1, 0x1, 0 if enable else 1)
         
     def setDelay(self, target, Align_Delay = None, ps_per_tap = None, useRaw = False):
         totdly = target
@@ -445,12 +475,11 @@ class PueoSURF:
             
         # disable VTC
         self.vtc(False)
-        self.write(self.map['TIOPDLYCNTA'], pdlya)
-        while self.read(self.map['TIOPDLYCNTA']) != pdlya:
-            pass
-        self.write(self.map['TIOPDLYCNTB'], pdlyb)
-        while self.read(self.map['TIOPDLYCNTB']) != pdlyb:
-            pass
+        # it takes a moment to update
+        for addr, dly in ((self.map['TIOPDLYCNTA'], pdlya), (self.map['TIOPDLYCNTB'], pdlyb)):
+            self.write(addr, dly)
+            if self.poll_until(addr, 0xFFFFFFFF, dly, timeout=0.1, strategy='spin') is None:
+                print("IDELAY never loaded?!?")
         # reenable VTC
         self.vtc(True)
 
@@ -580,13 +609,11 @@ class PueoSURF:
     def turfioSetOffset(self, val):
         # both bitslip reset and bitslip are flags
         # so don't need to clear them
-        r = bf(self.read(self.map['TIOCTRL']))
-        r[8] = 1
-        self.write(self.map['TIOCTRL'], int(r))
-        r[8] = 0
-        r[9] = 1
+        r = self.read(self.map['TIOCTRL'])
+        shadow_write(self, self.map['TIOCTRL'], self.TIO_BITSLIP_RST.set(r, 1))
+        r = self.TIO_BITSLIP.set(self.TIO_BITSLIP_RST.set(r, 0), 1)
         for i in range(val):
-            self.write(self.map['TIOCTRL'], int(r))
+            shadow_write(self, self.map['TIOCTRL'], r)
             
     def get_attenuator(self, ch):
         base = 0x14244 + (ch//2)*0x4000 + 0x4*(ch%2)
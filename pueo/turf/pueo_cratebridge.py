@@ -8,6 +8,8 @@ from ..common.dev_submod import dev_submod
 from enum import Enum
 
 class PueoLinkBridge(dev_submod):
+    addrspace = (1<<25)
+
     def __init__(self, dev, base):
         super().__init__(dev, base)
 
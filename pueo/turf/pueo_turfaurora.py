@@ -3,7 +3,7 @@ from ..common.dev_submod import dev_submod, bitfield, bitfield_ro, register, reg
 from ..common.uspeyescan import USPEyeScan
 
 from enum import Enum
-from functools import partial
+from functools import partial, cached_property
 import time
 
 # Module structure (referenced from base)
@@ -23,15 +23,19 @@ import time
 class PueoTURFAurora(dev_submod):
     def __init__(self, dev, base):
         super().__init__(dev, base)
-        self.scanner = []
+
+    @cached_property
+    def scanner(self):
+        scanner = []
         for i in range(4):
             # partials are more appropriate than lambdas and avoid
             # scoping issues in a loop.
-            self.scanner.append( USPEyeScan(partial(self.drpread, i),
-                                            partial(self.drpwrite, i),
-                                            partial(self.eyescanreset, i),
-                                            partial(self.up, i),
-                                            name="TURFIO"+str(i)))
+            scanner.append( USPEyeScan(partial(self.drpread, i),
+                                       partial(self.drpwrite, i),
+                                       partial(self.eyescanreset, i),
+                                       partial(self.up, i),
+                                       name="TURFIO"+str(i)))
+        return scanner
 
 
 ################################################################################################################
@@ -123,8 +127,7 @@ class PueoTURFAurora(dev_submod):
                 self.scanner[linkno].horzoffset = h
                 self.scanner[linkno].vertoffset = v
                 self.scanner[linkno].start()
-                while not self.scanner[linkno].complete():
-                    pass
+                self.scanner[linkno].wait_complete()
                 thisBer = ber(self.scanner[linkno].results())
                 # this makes the eye stand out more
                 if thisBer:
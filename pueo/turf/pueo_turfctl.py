@@ -1,9 +1,10 @@
 from ..common.bf import bf
-from ..common.dev_submod import dev_submod
+from ..common.dev_submod import dev_submod, shadow_invalidate
 
 from .pueo_turfif import PueoTURFIF
 
 from enum import Enum
+from functools import cached_property
 import time
 
 class PueoTURFCTL(dev_submod):
@@ -12,12 +13,30 @@ class PueoTURFCTL(dev_submod):
     
     def __init__(self, dev, base):
         super().__init__(dev, base)
-        self.tio = []
-        for i in range(4):
-            self.tio.append(PueoTURFIF(dev, base + 0x4000 + 0x1000*i))
+
+    # built on first use, there's 36 objects under here
+    @cached_property
+    def tio(self):
+        return [ PueoTURFIF(self.dev, self.base + 0x4000 + 0x1000*i) for i in range(4) ]
+
+    def bits(self):
+        """ all 32 TURFIO input bits, TURFIO by TURFIO """
+        return [ bit for tio in self.tio for bit in tio.bit ]
+
+    def locate_eyecenters(self, bits=None, verbose=False):
+        """
+        PueoTURFIOBit.locate_eyecenter on every bit (default all 32) in
+        lockstep. Returns the eyes, in the same order as the bits.
+        """
+        from .pueo_turfiobit import PueoTURFIOBit
+        if bits is None:
+            bits = self.bits()
+        return PueoTURFIOBit.locate_eyecenter_all(bits, verbose)
 
     def reset(self):
         print("Performing global TURFCTL reset")
+        # everything behind the banks gets reset, forget what we wrote
+        shadow_invalidate(self)
         # The global reset procedure is pretty awkward.
         rv = bf(self.read(self.map['CONTROL']))
         # set MMCM0/1 reset to stop clocks
@@ -40,15 +40,17 @@ class PueoTURFEvent(dev_submod):
     
     def statistics(self, verbose=True):
         """ Get event statistics """
-        s = [4*self.ndwords0,
-             4*self.ndwords1,
-             4*self.ndwords2,
-             4*self.ndwords3]
+        # NDWORDS0-3, OUTQWORDS and OUTEVENTS are contiguous
+        v = self.readblock(self.map['NDWORDS0'], 6).tolist()
+        s = [4*v[0],
+             4*v[1],
+             4*v[2],
+             4*v[3]]
         if verbose:
             for i in range(4):
                 print(f'TURFIO{i} : {s[i]} bytes received')
-        r = 8*self.outqwords
-        t = self.outevents
+        r = 8*v[4]
+        t = v[5]
         if verbose:
             print(f'OUT : {r} bytes sent in {t} frames')
         s.append(r)
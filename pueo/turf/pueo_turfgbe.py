@@ -3,7 +3,7 @@ from ..common.dev_submod import dev_submod
 from ..common.uspeyescan import USPEyeScan
 
 from enum import Enum
-from functools import partial
+from functools import partial, cached_property
 import time
 
 # Module structure (referenced from base)
@@ -21,15 +21,19 @@ class PueoTURFGBE(dev_submod):
 
     def __init__(self, dev, base):
         super().__init__(dev, base)
-        # use the factored-out eye scan functions
-        self.scanner = []
+
+    # use the factored-out eye scan functions
+    @cached_property
+    def scanner(self):
+        scanner = []
         for i in range(2):
             # partial is more appropriate here as we're in a loop
-            self.scanner.append(USPEyeScan( partial(self.drpread, i),
-                                            partial(self.drpwrite, i),
-                                            partial(self.eyescanreset, i),
-                                            partial(self.up, i),
-                                            "10GBE"+str(i)))
+            scanner.append(USPEyeScan( partial(self.drpread, i),
+                                       partial(self.drpwrite, i),
+                                       partial(self.eyescanreset, i),
+                                       partial(self.up, i),
+                                       "10GBE"+str(i)))
+        return scanner
 
     
             
@@ -93,8 +97,7 @@ class PueoTURFGBE(dev_submod):
                 self.scanner[linkno].horzoffset = h
                 self.scanner[linkno].vertoffset = v
                 self.scanner[linkno].start()
-                while not self.scanner[linkno].complete():
-                    pass
+                self.scanner[linkno].wait_complete()
                 r = self.scanner[linkno].results()
                 res.append(r)
                 thisBer = ber(r)
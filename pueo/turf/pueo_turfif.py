@@ -4,6 +4,7 @@ from ..common.dev_submod import dev_submod
 from .pueo_turfiobit import PueoTURFIOBit
 
 from enum import Enum
+from functools import cached_property
 
 # This is a single PUEO TURFIO interface.
 # Global controls
@@ -12,9 +13,10 @@ class PueoTURFIF(dev_submod):
            }
     def __init__(self, dev, base):
         super().__init__(dev, base)
-        self.bit = []
-        for i in range(8):
-            self.bit.append(PueoTURFIOBit(dev, base + 0x800 + 0x100*i))
+
+    @cached_property
+    def bit(self):
+        return [ PueoTURFIOBit(self.dev, self.base + 0x800 + 0x100*i) for i in range(8) ]
 
     @property
     def cin_offset(self):
@@ -3,6 +3,7 @@
 
 from ..common.bf import bf
 from ..common.dev_submod import dev_submod, bitfield, bitfield_ro, register, register_ro
+from ..common.dev_submod import readmany_multi, writemany_multi, shadow_invalidate, poll_until_multi
 from ..common import pueo_utils
 
 from enum import Enum
@@ -23,6 +24,11 @@ class PueoTURFIOBit(dev_submod):
             'BITSLIP' : 0xC0,  # capture and bitslip register
             'INTERVAL' : 0xE0  # bit error interval count
             }
+
+    # control bits in BITCTRL (rst, dis_vtc, enable). Nothing else in
+    # BITCTRL is used, it's written as 0 (like setDelay_all does).
+    shadow = { 0x000 : 0x00000013 }
+    shadow_flags = { 0x000 : 0xFFFFFFEC }
         
     def __init__(self, dev, base):
         super().__init__(dev, base)
@@ -154,18 +160,29 @@ class PueoTURFIOBit(dev_submod):
     def locate_eyecenter(self, verbose=False):
         pars = self.getParameters()
         sc = self.coarse_eyescan()
-        ss = self.process_coarse(sc)
+        ss, coarseEdge, minScan = self.coarse_edge(sc, verbose)
+        if coarseEdge is None:
+            return ss
+        fs = self.fine_eyescan(minScan, coarseEdge+200.0)
+        return self.fine_eye(sc, ss, coarseEdge, fs, pars, verbose)
+
+    # The two halves of locate_eyecenter, shared with the lockstep version.
+    # coarse_edge returns (ss, coarseEdge, minScan), or (eye, None, None)
+    # if it already knows the answer (or failed, and eye is None).
+    @classmethod
+    def coarse_edge(cls, sc, verbose=False):
+        ss = cls.process_coarse(sc)
         if ss is None:
             print("Eye scan failed!")
             print("Coarse scan:")
             print(sc)
-            return
+            return (None, None, None)
         if ss[1] is None:
             roughCenter = ss[0]+4
             roughCenterBitno = sc[ss[0]+4][2]            
             print("Can't locate eye transition (eye is too well centered)")
             print(f'Just using {1100.0}, it will be fine')
-            return (1100.0, roughCenterBitno)
+            return ((1100.0, roughCenterBitno), None, None)
         coarseEdge = ((ss[0] + ss[1])/2)*200.0
         if verbose:
             print("Coarse eye edge is at", coarseEdge)
@@ -175,8 +192,11 @@ class PueoTURFIOBit(dev_submod):
             minScan = 0
         else:
             minScan = coarseEdge - 200
-        fs = self.fine_eyescan(minScan, coarseEdge+200.0)
-        fineEdgeIdx = self.find_eyeedge(fs)
+        return (ss, coarseEdge, minScan)
+
+    @classmethod
+    def fine_eye(cls, sc, ss, coarseEdge, fs, pars, verbose=False):
+        fineEdgeIdx = cls.find_eyeedge(fs)
         fineEdge = (coarseEdge-200.0)+(fineEdgeIdx*pars[1])
         if verbose:            
             print("Fine eye edge is at", fineEdge, end='')        
@@ -190,6 +210,118 @@ class PueoTURFIOBit(dev_submod):
             print("sample center is at", eye[0], "with bit offset", eye[1])
         return eye
             
+    # Lockstep versions of the scans, for a whole list of bits at once
+    # (e.g. all 32 from PueoTURFCTL.bits()). Each step programs the
+    # delay on every bit in one batch, waits ONCE, and reads every error
+    # count and capture in one batch. Results are per bit, in the same
+    # format as the single-bit versions.
+    @staticmethod
+    def getParameters_all(bits):
+        r = readmany_multi([ (b, addr) for b in bits
+                             for addr in (b.map['MDLYCNTA'], b.map['MDLYCNTB']) ])
+        return [ (r[2*i]-r[2*i+1], 700.0/r[2*i+1]) for i in range(len(bits)) ]
+
+    @staticmethod
+    def setDelay_all(bits, totdlys, ctrl):
+        """
+        Set raw total delays on all bits (like setDelay(useRaw=True)).
+        ctrl is each bit's BITCTRL control bits, so they don't need reading.
+        """
+        pdlya = [ min(t, 511) for t in totdlys ]
+        pdlyb = [ max(t-511, 0) for t in totdlys ]
+        # disable VTC
+        writemany_multi([ (b, 0x0, c | 0x2) for b, c in zip(bits, ctrl) ])
+        for addr, dly in ((0x80, pdlya), (0x84, pdlyb)):
+            writemany_multi([ (b, addr, d) for b, d in zip(bits, dly) ])
+            # it takes a moment to update
+            r = poll_until_multi([ (b, addr, 0xFFFFFFFF, d) for b, d in zip(bits, dly) ],
+                                 timeout=0.1, strategy='spin', name='PueoTURFIOBit.setDelay_all')
+            if None in r:
+                print("IDELAY never loaded?!?")
+        writemany_multi([ (b, 0x0, c & ~0x2) for b, c in zip(bits, ctrl) ])
+
+    @staticmethod
+    def _scan_all(bits, steps, interval, sleeptime, capture):
+        """
+        steps is a list (one entry per bit) of lists of raw delays. Returns
+        per bit [ (errcnt, capture) ] or just [ errcnt ].
+        """
+        if len(bits) == 0:
+            return []
+        ctrl = [ c & 0x13 for c in readmany_multi([ (b, 0x0) for b in bits ]) ]
+        writemany_multi([ (b, b.map['INTERVAL'], interval) for b in bits ])
+        scans = [ [] for b in bits ]
+        for i in range(max(len(s) for s in steps)):
+            active = [ n for n in range(len(bits)) if i < len(steps[n]) ]
+            PueoTURFIOBit.setDelay_all([ bits[n] for n in active ],
+                                       [ steps[n][i] for n in active ],
+                                       [ ctrl[n] for n in active ])
+            time.sleep(sleeptime)
+            if capture:
+                r = readmany_multi([ (bits[n], addr) for n in active
+                                     for addr in (bits[n].map['BITERR'], bits[n].map['BITSLIP']) ])
+                for k, n in enumerate(active):
+                    scans[n].append((r[2*k], r[2*k+1]))
+            else:
+                r = readmany_multi([ (bits[n], bits[n].map['BITERR']) for n in active ])
+                for k, n in enumerate(active):
+                    scans[n].append(r[k])
+        # we wrote BITCTRL behind the shadow's back
+        for b in bits:
+            shadow_invalidate(b, 0x0)
+        return scans
+
+    @staticmethod
+    def coarse_eyescan_all(bits, pars=None):
+        if pars is None:
+            pars = PueoTURFIOBit.getParameters_all(bits)
+        steps = [ [ round(200.0*i/p[1]) + p[0] for i in range(12) ] for p in pars ]
+        raw = PueoTURFIOBit._scan_all(bits, steps, 131072, 0.002, True)
+        scans = []
+        for r in raw:
+            sc = []
+            for i, (errcnt, val) in enumerate(r):
+                bitno = None
+                if errcnt == 0:
+                    bitno = pueo_utils.check_eye(val)
+                    if bitno is not None:
+                        bitno = bitno % 4
+                sc.append((i, errcnt, bitno))
+            scans.append(sc)
+        return scans
+
+    @staticmethod
+    def fine_eyescan_all(bits, ranges, pars=None):
+        """ ranges is a (start, stop) time per bit, like fine_eyescan """
+        if pars is None:
+            pars = PueoTURFIOBit.getParameters_all(bits)
+        steps = [ list(range(p[0] + round(start/p[1]), p[0] + round(stop/p[1])))
+                  for p, (start, stop) in zip(pars, ranges) ]
+        return PueoTURFIOBit._scan_all(bits, steps, 1024, 0.001, False)
+
+    @staticmethod
+    def locate_eyecenter_all(bits, verbose=False):
+        """ locate_eyecenter on every bit, in lockstep. Returns the eyes, per bit. """
+        if len(bits) == 0:
+            return []
+        pars = PueoTURFIOBit.getParameters_all(bits)
+        scs = PueoTURFIOBit.coarse_eyescan_all(bits, pars)
+        eyes = [ None ]*len(bits)
+        fine = []
+        for n, sc in enumerate(scs):
+            ss, coarseEdge, minScan = PueoTURFIOBit.coarse_edge(sc, verbose)
+            if coarseEdge is None:
+                eyes[n] = ss
+            else:
+                fine.append((n, ss, coarseEdge, minScan))
+        if fine:
+            fss = PueoTURFIOBit.fine_eyescan_all([ bits[f[0]] for f in fine ],
+                                                 [ (f[3], f[2]+200.0) for f in fine ],
+                                                 [ pars[f[0]] for f in fine ])
+            for (n, ss, coarseEdge, minScan), fs in zip(fine, fss):
+                eyes[n] = PueoTURFIOBit.fine_eye(scs[n], ss, coarseEdge, fs, pars[n], verbose)
+        return eyes
+
     def apply_eye(self, eye):
         self.setDelay(eye[0])
         for i in range(eye[1]):
@@ -198,6 +330,16 @@ class PueoTURFIOBit(dev_submod):
         if r != pueo_utils.train32:
             raise IOError(f'Readback {hex(r)} not {hex(pueo_utils.train32)} after applying eye!')        
     
+    # apply a previously found eye and check it once
+    def try_eye(self, eye):
+        try:
+            self.apply_eye(eye)
+        except IOError:
+            return False
+        self.write(self.map['INTERVAL'], 131072)
+        time.sleep(0.002)
+        return self.biterr_count == 0
+
     def getParameters(self):
         # The monitor delay is "close enough" to the
         # cell above it that we can use it as the basis.
@@ -222,13 +364,10 @@ class PueoTURFIOBit(dev_submod):
                         
         # disable VTC
         self.dis_vtc = 1
-        self.pdlycnta = pdlya
         # it takes a moment to update
-        while self.pdlycnta != pdlya:
-            pass
-        self.pdlycntb = pdlyb
-        # takes a moment to update
-        while self.pdlycntb != pdlyb:
-            pass
+        for addr, dly in ((self.map['PDLYCNTA'], pdlya), (self.map['PDLYCNTB'], pdlyb)):
+            self.write(addr, dly)
+            if self.poll_until(addr, 0xFFFFFFFF, dly, timeout=0.1, strategy='spin') is None:
+                print("IDELAY never loaded?!?")
         self.dis_vtc = 0
 
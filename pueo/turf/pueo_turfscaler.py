@@ -89,10 +89,7 @@ class PueoTURFScaler(dev_submod):
 
     def scalers(self, verbose=False):
         """ Return all the scalers. To access one see the scaler() method """
-        r = []
-        for i in range(32):
-            d = self.read(4 * i)
-            r.append(d)
+        r = self.readblock(self.map['SCAL_BASE'], 32)
         # create a map number to name inside f string --> say what it is
         if verbose:
             for i in range(16):
@@ -106,10 +103,7 @@ class PueoTURFScaler(dev_submod):
     
     def leveltwos(self, verbose=False):
         """ Return all the L2 scalers. To access one see the leveltwo() method """
-        r = []
-        for i in range(24):
-            d = self.read(0xA0 + 4 * i)
-            r.append(d)
+        r = self.readblock(self.map['L2_BASE'], 24)
         # create a map number to name inside f string --> say what it is
         if verbose:
             for i in range(12):
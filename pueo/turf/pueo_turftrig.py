@@ -3,6 +3,7 @@ from ..common.dev_submod import dev_submod, bitfield, register, bitfield_ro, reg
 from .pueo_turfscaler import PueoTURFScaler
 
 from enum import Enum
+from functools import cached_property
 
 class PueoTURFTrig(dev_submod):
     """ Trigger core. """
@@ -37,7 +38,10 @@ class PueoTURFTrig(dev_submod):
     def __init__(self, dev, base):
         super().__init__(dev, base)
 
-        self.scaler = PueoTURFScaler(self.dev, base+0x300)
+    # built on first use
+    @cached_property
+    def scaler(self):
+        return PueoTURFScaler(self.dev, self.base+0x300)
         
 ################################################################################################################
 # REGISTER SPACE                                                                                               #
@@ -82,21 +86,22 @@ class PueoTURFTrig(dev_submod):
                      notch0_vpol = None,
                      notch1_hpol = None,
                      notch1_vpol = None):
-        # this is all silliness for Python.
-        # You could update the notch registers all at once
-        # if you wanted. They can be freely read/written,
+        # The notch registers can be freely read/written,
         # they just won't update until register 0x01C
-        # is written to.
-        if notch0_hpol:
-            self.hpol_notch0 = notch0_hpol
-        if notch0_vpol:
-            self.vpol_notch0 = notch0_vpol
-        if notch1_hpol:
-            self.hpol_notch1 = notch1_hpol
-        if notch1_vpol:
-            self.vpol_notch1 = notch1_vpol
-        # literally anything written to this register will do it
-        self.write(0x1c, 1)
+        # is written to. So queue everything up and
+        # send it all at once: the fields sharing a
+        # register merge into one write.
+        with self.transaction():
+            if notch0_hpol:
+                self.hpol_notch0 = notch0_hpol
+            if notch0_vpol:
+                self.vpol_notch0 = notch0_vpol
+            if notch1_hpol:
+                self.hpol_notch1 = notch1_hpol
+            if notch1_vpol:
+                self.vpol_notch1 = notch1_vpol
+            # literally anything written to this register will do it
+            self.write(0x1c, 1)
     
     def runcmd(self, val):
         self.write(0, val)
@@ -1,23 +1,16 @@
-from ..common.serialcobsdevice import SerialCOBSDevice
 from ..common.bf import bf
-from ..common.dev_submod import dev_submod, register, bitfield, register_ro, bitfield_ro
+from ..common import pueo_utils
+from ..common.dev_submod import dev_submod, register, bitfield, register_ro, bitfield_ro, transaction, snapshot, poll_until
 
-from .pueo_turfctl import PueoTURFCTL
-from .pueo_turfaurora import PueoTURFAurora
-from .pueo_turfgbe import PueoTURFGBE
-from .pueo_cratebridge import PueoCrateBridge
-from .pueo_turfevent import PueoTURFEvent
-from .pueo_turftrig import PueoTURFTrig
-from .pueo_turftime import PueoTURFTime
-
-from ..common.pyaxibridge import PyAXIBridge
+# The other transports (and the cores) are imported when they're
+# used: asyncio, ctypes, serial and numpy are most of the time it
+# takes to import this.
 from ..common.ethdevice import EthDevice
 
-import mmap
 import struct
-import os
 import time
 from enum import Enum
+from functools import cached_property
 
 class PueoTURF:
     """ TURF device. Note that the current Serial access path is deprecated """
@@ -57,6 +50,8 @@ class PueoTURF:
         SERIAL = 'Serial'
         ETH = 'Ethernet'
         AXI = 'AXI'
+        AXILIB = 'AXI library'
+        BROKER = 'Broker'
         DUMMY = 'DUMMY'
 
     # search device tree nodes to grab base/size
@@ -76,16 +71,34 @@ class PueoTURF:
         size , = struct.unpack(">Q", vals[8:16])
         return (base, size)
         
-    def __init__(self, accessInfo=None, type=AccessType.ETH):
+    # attach=True just connects: no writes, no sleeps, nothing gets set
+    # up. Use it for monitoring something that's already running.
+    def __init__(self, accessInfo=None, type=AccessType.ETH, attach=False):
         if type == self.AccessType.SERIAL:
+            from ..common.serialcobsdevice import SerialCOBSDevice
             self.dev = SerialCOBSDevice(accessInfo, 115200, addrbytes=4)
+            self.devpath = f'serial:{accessInfo}'
             self.reset = self.dev.reset
             self.read = self.dev.read
             self.write = self.dev.write
             self.writeto = self.dev.writeto
-            self.dev.reset()
+            if not attach:
+                self.dev.reset()
         elif type == self.AccessType.AXI:
+            # accessInfo is (base, size) or (base, size, path)
+            from ..common.mmapaxibridge import MmapAXIBridge
+            if accessInfo is None:
+                accessInfo = self.axilite_bridge()
+            self.dev = MmapAXIBridge(*accessInfo)
+            self.devpath = f'axi:{accessInfo[0]:x}'
+            self.reset = lambda : None
+            self.read = self.dev.read
+            self.write = self.dev.write
+            self.writeto = self.dev.write
+        elif type == self.AccessType.AXILIB:
+            from ..common.pyaxibridge import PyAXIBridge
             self.dev = PyAXIBridge(accessInfo[0], accessInfo[1])
+            self.devpath = f'axi:{accessInfo[0]:x}'
             self.reset = lambda : None
             self.read = self.dev.read
             self.write = self.dev.write
@@ -96,7 +109,21 @@ class PueoTURF:
                                      local_ip = accessInfo[1])
             else:
                 self.dev = EthDevice()
+            self.devpath = f'eth:{self.dev.remote_ip}'
                 
+            self.read = self.dev.read
+            self.write = self.dev.write
+            self.writeto = self.dev.write
+            self.reset = lambda : None
+        elif type == self.AccessType.BROKER:
+            # accessInfo is the broker's socket path
+            from ..common.regbroker import BrokerDevice
+            if accessInfo is not None:
+                self.dev = BrokerDevice(accessInfo)
+            else:
+                self.dev = BrokerDevice()
+            self.devpath = f'broker:{self.dev.path}'
+
             self.read = self.dev.read
             self.write = self.dev.write
             self.writeto = self.dev.write
@@ -120,8 +147,26 @@ class PueoTURF:
                 def write(self, addr, value):
                     print(f'write: address {hex(addr)} value {hex(value)}')
                     self.regs[addr] = value
+
+                def readmany(self, addrs):
+                    return [ self.read(a) for a in addrs ]
+
+                def writemany(self, addrs, values):
+                    for a, v in zip(addrs, values):
+                        self.write(a, v)
+
+                def readblock(self, base, n, stride=4):
+                    import numpy as np
+                    return np.array(self.readmany(range(base, base+n*stride, stride)),
+                                    dtype=np.uint32)
+
+                def writeblock(self, base, data, stride=4):
+                    self.writemany(range(base, base+len(data)*stride, stride),
+                                   [ int(v) for v in data ])
                     
             self.dev = Dummy()
+            # never cache anything for a dummy
+            self.devpath = None
             self.read = self.dev.read
             self.write = self.dev.write
             self.writeto = self.dev.write
@@ -129,18 +174,58 @@ class PueoTURF:
         else:
             raise Exception("type must be one of",
                             [e.value for e in self.AccessType])
-            
-        self.ctl = PueoTURFCTL(self.dev, 0x10000)
-        self.aurora = PueoTURFAurora(self.dev, 0x8000)
-        self.gbe = PueoTURFGBE(self.dev, 0x4000)
-        self.event = PueoTURFEvent(self.dev, 0x18000)
-        self.trig = PueoTURFTrig(self.dev, 0x1C000)
-        self.time = PueoTURFTime(self.dev, 0x1A000)
-        
-        self.crate = PueoCrateBridge(self.dev, (1<<27))
+
+        # batched accesses come straight from the transport
+        self.readmany = self.dev.readmany
+        self.writemany = self.dev.writemany
+        self.readblock = self.dev.readblock
+        self.writeblock = self.dev.writeblock
+
         self.clockMonValue = 100000000
-        self.write(self.map['SYSCLKMON'], self.clockMonValue)
-        time.sleep(0.1)
+        if not attach:
+            self.write(self.map['SYSCLKMON'], self.clockMonValue)
+            time.sleep(0.1)
+
+    # We (and the submodules) really go straight to the transport, so
+    # batches, the shadow and transactions all see one root.
+    def _resolve(self):
+        return (self.dev, 0)
+
+    # The submodules only get built the first time they're used.
+    @cached_property
+    def ctl(self):
+        from .pueo_turfctl import PueoTURFCTL
+        return PueoTURFCTL(self.dev, 0x10000)
+
+    @cached_property
+    def aurora(self):
+        from .pueo_turfaurora import PueoTURFAurora
+        return PueoTURFAurora(self.dev, 0x8000)
+
+    @cached_property
+    def gbe(self):
+        from .pueo_turfgbe import PueoTURFGBE
+        return PueoTURFGBE(self.dev, 0x4000)
+
+    @cached_property
+    def event(self):
+        from .pueo_turfevent import PueoTURFEvent
+        return PueoTURFEvent(self.dev, 0x18000)
+
+    @cached_property
+    def trig(self):
+        from .pueo_turftrig import PueoTURFTrig
+        return PueoTURFTrig(self.dev, 0x1C000)
+
+    @cached_property
+    def time(self):
+        from .pueo_turftime import PueoTURFTime
+        return PueoTURFTime(self.dev, 0x1A000)
+
+    @cached_property
+    def crate(self):
+        from .pueo_cratebridge import PueoCrateBridge
+        return PueoCrateBridge(self.dev, (1<<27))
 
 
     class GpoSelect(int, Enum):
@@ -160,25 +245,29 @@ class PueoTURF:
     gpo_en           =    bitfield(0x00C, 15,       0x0001, "Enable the TOUT output")
 
         
-    def dna(self):
-        self.write(self.map['DNA'], 0x80000000)
-        dnaval = 0
-        for i in range(57):
-            r = self.read(self.map['DNA'])
-            val = r & 0x1
-            dnaval = (dnaval << 1) | val
-        return dnaval
+    def transaction(self):
+        """ Queue and merge writes until the with block exits (see dev_submod.transaction) """
+        return transaction(self)
+
+    def snapshot(self, fields=None, record=False):
+        """ Read all (or the named) register fields at once (see dev_submod.snapshot) """
+        return snapshot(self, fields, record)
+
+    def poll_until(self, addr, mask, value, timeout=1.0, strategy='backoff', name=None):
+        """ Wait for (read(addr) & mask) == value (see dev_submod.poll_until) """
+        return poll_until(self, addr, mask, value, timeout, strategy, name)
+
+    def dna(self, refresh=False):
+        """ Device DNA, from the on-disk cache if we've seen this device/firmware before """
+        return pueo_utils.cached_dna(self, self.devpath,
+                                     self.read(self.map['FPGA_DATEVERSION']),
+                                     self.map['DNA'], refresh)
 
     def status(self, verbose=True):
         id_dict = self.identify(verbose=verbose)
-        d = {}
-        d['SYSCLK'] = self.read(self.map['SYSCLKMON'])
-        d['GBECLK'] = self.read(self.map['GBECLKMON'])
-        d['DDR0CLK'] = self.read(self.map['DDR0CLKMON'])
-        d['DDR1CLK'] = self.read(self.map['DDR1CLKMON'])
-        d['AURCLK'] = self.read(self.map['AURCLKMON'])
-        d['GRXCLK'] = self.read(self.map['GRXCLKMON'])
-        d['GTXCLK'] = self.read(self.map['GTXCLKMON'])
+        # clock monitors are contiguous from SYSCLKMON to GTXCLKMON
+        clks = [ 'SYSCLK', 'GBECLK', 'DDR0CLK', 'DDR1CLK', 'AURCLK', 'GRXCLK', 'GTXCLK' ]
+        d = dict(zip(clks, self.readblock(self.map['SYSCLKMON'], len(clks)).tolist()))
         if verbose:
             for k in d.keys():
                 print(f'{k}: {d[k]}')
@@ -208,30 +297,191 @@ class PueoTURF:
                 print('')
         return id
     
+    # Crate-wide inventory. Everything goes through our transport, so
+    # instead of identify() on 33 boards one read at a time, each level
+    # (TURF, the TURFIOs, the SURFs, then the DNAs) is ONE batch of
+    # reads across every device at that level.
+    TURF_CLKS = [ 'SYSCLK', 'GBECLK', 'DDR0CLK', 'DDR1CLK', 'AURCLK', 'GRXCLK', 'GTXCLK' ]
+    TURFIO_CLKS = [ 'SYSCLK', 'GTPCLK', 'RXCLK', 'HSRXCLK', 'CLK200' ]
+    SURF_CLKS = [ 'ACLK', 'GTPCLK', 'RXCLK', 'CLK300', 'IFCLK', 'RACKCLK' ]
+
+    def inventory(self, verbose=True, refresh=False):
+        """
+        Identify the TURF, every TURFIO whose Aurora link is up and every
+        live SURF behind those (enabling the TURFIO bridges if needed).
+        Returns a list of dicts, one per FPGA: name, link, slot, FPGA,
+        DateVersion, DNA (cached, see dna()), clocks, live, misaligned.
+        """
+        from ..turfio.turfio import PueoTURFIO
+        from ..surf.surf import PueoSURF
+        from ..common.dev_submod import _resolve_root
+
+        def str4(num):
+            return bytes([ (num>>24)&0xFF, (num>>16)&0xFF, (num>>8)&0xFF, num&0xFF ]).decode(errors='replace')
+
+        def idclk(base, clkbase, clks):
+            return [ base, base+4 ] + [ base+clkbase+4*i for i in range(len(clks)) ]
+
+        # TURF level: us, the link status and the bridge control
+        addrs = idclk(0, self.map['SYSCLKMON'], self.TURF_CLKS)
+        addrs += [ self.aurora.base + 0x800*n + 0x4 for n in range(4) ]
+        addrs += [ self.map['BRIDGECTRL'] ]
+        r = self.dev.readmany(addrs)
+        nclk = len(self.TURF_CLKS)
+        rows = [ { 'name' : 'TURF', 'link' : None, 'slot' : None,
+                   'FPGA' : str4(r[0]), 'DateVersion' : self.DateVersion(r[1]),
+                   'dateversion' : r[1], 'devpath' : self.devpath,
+                   'dnaaddr' : self.map['DNA'],
+                   'clocks' : dict(zip(self.TURF_CLKS, r[2:2+nclk])),
+                   'live' : None, 'misaligned' : None } ]
+        links = [ n for n in range(4) if r[2+nclk+n] & 0x3 == 0x3 ]
+        brctl = r[-1]
+        want = brctl
+        for n in links:
+            want = (want & ~(0xFF << 8*n)) | (1 << 8*n)
+        if want != brctl:
+            self.write(self.map['BRIDGECTRL'], want)
+            self.write(self.map['BRIDGESTAT'], 0)
+
+        # TURFIO level
+        lbase = { n : _resolve_root(self.crate.link[n])[1] for n in links }
+        nclk = len(self.TURFIO_CLKS)
+        addrs = []
+        for n in links:
+            addrs += idclk(lbase[n], PueoTURFIO.map['SYSCLKMON'], self.TURFIO_CLKS)
+            addrs += [ lbase[n] + PueoTURFIO.map['SURFTURFCOMMON'],
+                       lbase[n] + PueoTURFIO.map['SURFTURFCOMMON'] + 0x10 ]
+        r = self.dev.readmany(addrs)
+        step = 2 + nclk + 2
+        surfs = []
+        for i, n in enumerate(links):
+            t = r[i*step:(i+1)*step]
+            rxclk_disable = (t[-2] >> 24) & 0xFF
+            live = t[-1] & 0x7F
+            misaligned = (t[-1] >> 16) & 0x7F
+            rows.append({ 'name' : f'TURFIO{n}', 'link' : n, 'slot' : None,
+                          'FPGA' : str4(t[0]), 'DateVersion' : PueoTURFIO.DateVersion(t[1]),
+                          'dateversion' : t[1],
+                          'devpath' : None if self.devpath is None else f'{self.devpath}/link{n}',
+                          'dnaaddr' : lbase[n] + PueoTURFIO.map['DNA'],
+                          'clocks' : dict(zip(self.TURFIO_CLKS, t[2:2+nclk])),
+                          'live' : live, 'misaligned' : misaligned })
+            for slot in range(7):
+                if (live & (1<<slot)) and not (rxclk_disable & (1<<slot)):
+                    surfs.append((n, slot, (misaligned >> slot) & 1))
+
+        # SURF level
+        nclk = len(self.SURF_CLKS)
+        addrs = []
+        sbase = {}
+        for n, slot, mis in surfs:
+            sbase[(n, slot)] = lbase[n] + PueoTURFIO.map['SURFBRIDGE'] + 0x400000*slot
+            addrs += idclk(sbase[(n, slot)], PueoSURF.map['ACLKMON'], self.SURF_CLKS)
+        r = self.dev.readmany(addrs)
+        step = 2 + nclk
+        for i, (n, slot, mis) in enumerate(surfs):
+            s = r[i*step:(i+1)*step]
+            rows.append({ 'name' : f'TURFIO{n}.SURF{slot}', 'link' : n, 'slot' : slot,
+                          'FPGA' : str4(s[0]), 'DateVersion' : PueoSURF.DateVersion(s[1]),
+                          'dateversion' : s[1],
+                          'devpath' : None if self.devpath is None else f'{self.devpath}/link{n}/surf{slot}',
+                          'dnaaddr' : sbase[(n, slot)] + PueoSURF.map['DNA'],
+                          'clocks' : dict(zip(self.SURF_CLKS, s[2:])),
+                          'live' : 1, 'misaligned' : mis })
+
+        # DNAs: whatever isn't cached gets read all at once
+        cache = pueo_utils.dna_cache_load()
+        need = []
+        for row in rows:
+            key = None if row['devpath'] is None else pueo_utils.dna_key(row['devpath'], row['dateversion'])
+            if refresh or key is None or key not in cache:
+                need.append((row, key))
+            else:
+                row['DNA'] = cache[key]
+        if need:
+            dnas = pueo_utils.read_dna_many(self.dev, [ row['dnaaddr'] for row, key in need ])
+            for (row, key), dna in zip(need, dnas):
+                row['DNA'] = dna
+                if key is not None:
+                    cache[key] = dna
+            pueo_utils.dna_cache_store(cache)
+
+        for row in rows:
+            for k in ('dateversion', 'devpath', 'dnaaddr'):
+                del row[k]
+        if verbose:
+            for row in rows:
+                mis = '' if row['misaligned'] is None else (f' misaligned {bin(row["misaligned"])}' if row['slot'] is None
+                                                            else (' MISALIGNED' if row['misaligned'] else ''))
+                live = '' if row['live'] is None or row['slot'] is not None else f' live {bin(row["live"])}'
+                print(f'{row["name"]:<14} {row["FPGA"]} {str(row["DateVersion"]):<28} {row["DNA"]:#017x}{live}{mis}')
+                print(' '*15 + ' '.join(f'{k}: {v}' for k, v in row['clocks'].items()))
+        return rows
+
+    def align_bits(self, bits=None, cache=None, verbose=False):
+        """
+        Align the TURF-side TURFIO input bits (default all 32). Cached
+        eyes are applied and checked first, only the bits that fail get
+        the (lockstep) full scan. cache is an AlignCache, or None to use
+        the default one. Returns the eyes, in the same order as the bits.
+        """
+        from ..common.aligncache import AlignCache
+        from .pueo_turfiobit import PueoTURFIOBit
+        if cache is None:
+            cache = AlignCache()
+        if bits is None:
+            bits = self.ctl.bits()
+        board = cache.board(self)
+        # bits are 0x100 apart, TURFIOs 0x1000
+        keys = [ cache.key(board, 'bit', '%d.%d' % ((b.base >> 12) & 0x3, (b.base >> 8) & 0x7))
+                 for b in bits ]
+        eyes = [ cache.get(key) for key in keys ]
+        rescan = cache.warm(keys, lambda n, eye : bits[n].try_eye(eye), verbose)
+        if verbose:
+            print(f'{len(bits)-len(rescan)} bits aligned from cache, {len(rescan)} to scan')
+        if rescan:
+            found = PueoTURFIOBit.locate_eyecenter_all([ bits[n] for n in rescan ], verbose)
+            for n, eye in zip(rescan, found):
+                eyes[n] = eye
+                if eye is None:
+                    print(f'{keys[n]}: no eye found!')
+                    continue
+                try:
+                    bits[n].apply_eye(eye)
+                except IOError as e:
+                    print(f'{keys[n]}: {e}')
+                    continue
+                cache.put(keys[n], eye)
+        cache.save()
+        return eyes
+
     def evstatus(self): 
         print('Event Statistics: ')
         self.event.statistics()
-        print(f'Reset status: {self.event.event_in_reset} (Force reset = {self.event.event_reset})')
-        print(f'Event (TURFIO) mask is currently: {bin(self.event.current_mask)} - desired is {bin(self.event.mask)}') 
-        print(f'Running status: {self.trig.running}')
-        print(f'Trigger count: {self.trig.trigger_count}')
-        print(f'Ack FIFO count: {self.event.ack_count}')
-        print(f'Completion FIFO count: {self.event.completion_count}')
-        print(f'Allow counter: {self.event.allow_count}')
-        print(f'Occupancy: {self.trig.occupancy/125e6}')
-        print(f'Track error: {bin(self.event.track_err)}')
-        print(f'Event path errors: {hex(self.event.error0)}, {hex(self.event.error1)}, {hex(self.event.error2)}')
+        # every field in CTRL comes out of one read now
+        ev = self.event.snapshot([ 'event_in_reset', 'event_reset', 'current_mask', 'mask',
+                                   'track_err', 'ack_count', 'allow_count', 'completion_count',
+                                   'error0', 'error1', 'error2' ])
+        tr = self.trig.snapshot([ 'running', 'trigger_count', 'occupancy' ])
+        print(f'Reset status: {ev["event_in_reset"]} (Force reset = {ev["event_reset"]})')
+        print(f'Event (TURFIO) mask is currently: {bin(ev["current_mask"])} - desired is {bin(ev["mask"])}') 
+        print(f'Running status: {tr["running"]}')
+        print(f'Trigger count: {tr["trigger_count"]}')
+        print(f'Ack FIFO count: {ev["ack_count"]}')
+        print(f'Completion FIFO count: {ev["completion_count"]}')
+        print(f'Allow counter: {ev["allow_count"]}')
+        print(f'Occupancy: {tr["occupancy"]/125e6}')
+        print(f'Track error: {bin(ev["track_err"])}')
+        print(f'Event path errors: {hex(ev["error0"])}, {hex(ev["error1"])}, {hex(ev["error2"])}')
         
     def tstatus(self, verbose=True):
         if verbose:
             print('Time Statistics:')
-        d = {}
-        d['current_second'] = self.time.current_second
-        d['last_pps'] = self.time.last_pps
-        d['llast_pps'] = self.time.llast_pps
-        d['last_dead'] = self.time.last_dead
-        d['llast_dead'] = self.time.llast_dead
-        d['panic_counter'] = self.time.panic_counter
+        # SECOND has to be read first to capture the rest, and the
+        # block read goes in address order, so this is all one moment
+        keys = [ 'current_second', 'last_pps', 'llast_pps',
+                 'last_dead', 'llast_dead', 'panic_counter' ]
+        d = dict(zip(keys, self.time.readblock(self.time.map['SECOND'], len(keys)).tolist()))
         d['frequency'] = (d['last_pps']-d['llast_pps']) & 0xFFFFFFFF
         d['dead_fraction'] = ((d['last_dead']-d['llast_dead']) & 0xFFFFFFFF)/(d['frequency'])
         for key in d:
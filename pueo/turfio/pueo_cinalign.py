@@ -1,12 +1,16 @@
 import time
 
 from .pueo_hsalign import PueoHSAlign
+from ..common import pueo_utils
 from ..common.dev_submod import bitfield, bitfield_ro, register, register_ro
 
 class PueoCINAlign(PueoHSAlign):
     """
     High-speed alignment module for the TURF CIN on the TURFIO.
     """
+    # adds lock reset, lock request and the rxclk phase
+    shadow = { 0x000 : PueoHSAlign.shadow[0x000] | 0x00FF0108 }
+
     def __init__(self, dev, base):
         # Create our map.
         our_map = dict(zip(PueoHSAlign.BW32_MAP.keys(),
@@ -33,17 +37,24 @@ class PueoCINAlign(PueoHSAlign):
     lock_rst         =    bitfield(0x000,  3,       0x0001, "CIN lock reset")
     locked           = bitfield_ro(0x000,  9,       0x0001, "CIN locked status")
     
-    # rxclk eyescan
-    def eyescan_rxclk(self, period=1024):
+    # rxclk eyescan. stride=None samples all 448 phases, otherwise
+    # it's an adaptive search (see pueo_utils.adaptive_eyescan).
+    def eyescan_rxclk(self, period=1024, stride=None):
         slptime = period*8E-9
-        sc = []
         self.rxclk_phase = 0
         self.write(0x1C, period)
-        for i in range(448):
+        def sample(i):
             self.rxclk_phase = i
             time.sleep(slptime)
-            sc.append(self.read(0x1C))
-        return sc
+            return self.read(0x1C)
+        return pueo_utils.adaptive_eyescan(sample, 448, stride)
+
+    # set a previously found rxclk phase and check it once
+    def try_rxclk(self, phase, period=1024):
+        self.rxclk_phase = phase
+        self.write(0x1C, period)
+        time.sleep(period*8E-9)
+        return self.read(0x1C) == 0
 
     # RXCLK scan method
     @staticmethod
@@ -81,11 +92,12 @@ class PueoCINAlign(PueoHSAlign):
 
         return eyes
 
-    # Alignment method for RXCLK.
-    def align_rxclk(self, verbose=False):
+    # Alignment method for RXCLK. stride is passed to eyescan_rxclk:
+    # the default (None) does the full sweep.
+    def align_rxclk(self, verbose=False, stride=None):
         if verbose:
             print("Scanning RXCLK->SYSCLK transition.")
-        rxsc = self.eyescan_rxclk()
+        rxsc = self.eyescan_rxclk(stride=stride)
         eyes = self.process_eyescan_rxclk(rxsc)
         bestEye = None
         for eye in eyes:
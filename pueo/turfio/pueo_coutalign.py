@@ -2,6 +2,8 @@ from .pueo_hsalign import PueoHSAlign
 from ..common.dev_submod import bitfield, bitfield_ro, register, register_ro
 
 class PueoCOUTAlign(PueoHSAlign):
+    # adds enable
+    shadow = { 0x000 : PueoHSAlign.shadow[0x000] | 0x00000100 }
 
     def __init__(self, dev, base):
         super().__init__(dev, base,
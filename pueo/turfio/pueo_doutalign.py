@@ -2,6 +2,8 @@ from .pueo_hsalign import PueoHSAlign
 from ..common.dev_submod import bitfield, bitfield_ro, register, register_ro
 
 class PueoDOUTAlign(PueoHSAlign):
+    # adds capture phase and enable
+    shadow = { 0x000 : PueoHSAlign.shadow[0x000] | 0x00000180 }
 
     def __init__(self, dev, base):
         super().__init__(dev, base,
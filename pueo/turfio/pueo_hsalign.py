@@ -7,6 +7,7 @@
 import time
 
 from ..common.dev_submod import dev_submod, bitfield, bitfield_ro, register, register_ro
+from ..common.dev_submod import readmany_multi, writemany_multi
 
 class PueoHSAlign(dev_submod):
     # maps are here for convenience
@@ -65,6 +66,10 @@ class PueoHSAlign(dev_submod):
             'BITERR' : 0x8,
             'BITSLP' : 0xC }
 
+    # control bits in CTLRESET (iserdes/oserdes reset, train enable).
+    # The rest of CTLRESET isn't described, so setters still read it.
+    shadow = { 0x000 : 0x00000414 }
+
     def __init__(self, dev, base,
                  bit_width = 32,
                  max_idelay_taps = 63,
@@ -156,9 +161,12 @@ class PueoHSAlign(dev_submod):
 
     @idelay.setter
     def idelay(self, value):
+        self.idelay_raw = self.idelay_to_raw(value)
+
+    def idelay_to_raw(self, value):
         if self.max_taps > 32:
             value = value + 1 if value & 32 else value
-        self.idelay_raw = value
+        return value
 
     def bitslip(self, n):
         """
@@ -185,6 +193,34 @@ class PueoHSAlign(dev_submod):
                 sc.append(biterr)
         return sc
         
+    @staticmethod
+    def eyescan_all(aligners, slptime=0.01, get_bitno=True, cntclks=131072):
+        """
+        eyescan() on a bunch of aligners in lockstep: each tap gets set
+        on all of them, there's one sleep, and then all of the bit error
+        counts and captures come back in one batch. Returns a list of
+        scans (in the same order as aligners) just like eyescan() does.
+        """
+        writemany_multi([ (a, 0x8, cntclks) for a in aligners ])
+        scans = [ [] for a in aligners ]
+        for i in range(max(a.max_taps for a in aligners)):
+            active = [ n for n, a in enumerate(aligners) if i < a.max_taps ]
+            writemany_multi([ (aligners[n], 0x4, aligners[n].idelay_to_raw(i)) for n in active ])
+            time.sleep(slptime)
+            # capture gets read whether or not it's needed, it's free here
+            r = readmany_multi([ (aligners[n], addr) for n in active for addr in (0x8, 0xC) ])
+            for k, n in enumerate(active):
+                biterr, test = r[2*k], r[2*k+1]
+                if get_bitno:
+                    if biterr == 0:
+                        nb = aligners[n].train_map[test] if test in aligners[n].train_map else None
+                        scans[n].append((biterr, nb))
+                    else:
+                        scans[n].append((biterr, None))
+                else:
+                    scans[n].append(biterr)
+        return scans
+
     def find_alignment(self, do_reset=True, verbose=False):
         """
         Find the eyes in a link. Returns a dictionary
@@ -224,4 +260,30 @@ class PueoHSAlign(dev_submod):
         if verbose:
             print(f'Alignment succeeded.')
         return True
+
+    def verify_alignment(self, slptime=0.01, cntclks=131072):
+        """
+        Checks a link once: True if there are no bit errors
+        and the capture needs no slips.
+        """
+        self.write(0x8, cntclks)
+        time.sleep(slptime)
+        if self.read(0x8) != 0:
+            return False
+        test = self.read(0xC)
+        return self.train_map.get(test) == 0
+
+    def try_alignment(self, eye, do_reset=True, verbose=False):
+        """
+        Applies a previously found eye (e.g. from an AlignCache)
+        and verifies it. Returns True if it worked.
+        """
+        if do_reset:
+            self.iserdes_reset = 1
+            self.iserdes_reset = 0
+        try:
+            self.apply_alignment(eye, verbose=verbose)
+        except IOError:
+            return False
+        return self.verify_alignment()
     
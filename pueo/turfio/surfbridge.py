@@ -5,6 +5,8 @@ from ..common.dev_submod import dev_submod
 # I don't think I actually need anything else right now.
 # Maybe I'll put address checking in here.
 class SURFBridge(dev_submod):
+    addrspace = 0x400000
+
     def __init__(self, dev, base):
         super().__init__(dev, base)
 
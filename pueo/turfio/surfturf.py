@@ -1,5 +1,5 @@
 from ..common.bf import bf
-from ..common.dev_submod import dev_submod, bitfield, bitfield_ro, register, register_ro
+from ..common.dev_submod import dev_submod, bitfield, bitfield_ro, register, register_ro, shadow_write
 from ..common.uploader import Uploader
 import os
 import struct
@@ -16,6 +16,12 @@ class SURFTURF(dev_submod):
             'TRAINOUT' : 0x18,
             'TRAINCMPL' : 0x1C,
             'COUTCTRL' : 0x20 }
+
+    # the RXCLK disables in CTRL are control bits, the mark bits (9:8)
+    # clear themselves (see mark()) so they're never written back. The
+    # rest of CTRL isn't described, so setters still read it.
+    shadow = { 0x000 : 0xFF000000 }
+    shadow_flags = { 0x000 : 0x00000300 }
     
     def __init__(self, dev, base):
         super().__init__(dev, base)
@@ -46,10 +52,9 @@ class SURFTURF(dev_submod):
         else:
             rv[9:8] = 2
             
-        self.write(0x0, int(rv))
-        rv = bf(self.read(0x0))
-        while rv[9:8]:
-            rv = bf(self.read(0x0))
+        shadow_write(self, 0x0, int(rv))
+        if self.poll_until(0x0, 0x300, 0) is None:
+            print("Bank %d was never taken?!?" % bank)
             
     # need to add runmode/trigger            
     def fwupd(self, val):
@@ -5,22 +5,16 @@
 # either the TURF or the housekeeping serial. Note that the TURF may
 # have multiple access methods, not sure about that yet.
 #
-from ..common.serialcobsdevice import SerialCOBSDevice
 from ..common.bf import bf
-from ..common.dev_submod import dev_submod
-from ..common.genshift import GenShift
-from ..common.genspi import GenSPI
+from ..common.dev_submod import dev_submod, transaction, snapshot, poll_until
 from ..common import pueo_utils
 
-from .pueo_cinalign import PueoCINAlign
-from .pueo_coutalign import PueoCOUTAlign
-from .pueo_doutalign import PueoDOUTAlign
-from .surfbridge import SURFBridge
-from .turfio_i2c_bb import PueoTURFIOI2C
-from .surfturf import SURFTURF
-
+# The serial transport and the submodules are imported when they're
+# used, so just importing this stays quick.
 from enum import Enum
+from functools import cached_property
 import time
+import itertools
 import glob
 
 class PueoTURFIO:
@@ -116,21 +110,36 @@ class PueoTURFIO:
         Use the clock from the TURF (normal operation).
         """
 
-    def __init__(self, accessInfo, type=AccessType.SERIAL):
+    # attach=True just connects: no writes, no sleeps, the bridge and
+    # GenShift are assumed to already be set up.
+    def __init__(self, accessInfo, type=AccessType.SERIAL, attach=False):
         if type == self.AccessType.SERIAL:
             # WE GO EVEN FASTER NOW
+            from ..common.serialcobsdevice import SerialCOBSDevice
             self.dev = SerialCOBSDevice(accessInfo, 2500000, 3)
+            self.devpath = f'serial:{accessInfo}'
             self.reset = self.dev.reset
             self.read = self._dbgRead
             self.write = self._dbgWrite
+            self.readmany = self._dbgReadmany
+            self.writemany = self._dbgWritemany
+            self.readblock = self._dbgReadblock
+            self.writeblock = self._dbgWriteblock
             # NOTE: THERE IS NO UPPER ADDRESS HANDLING IN WRITETO!
             # DO IT YOURSELF!!
             self.writeto = self.dev.writeto
             # NOTE: THERE IS NO UPPER ADDRESS HANDLING IN MULTIWRITE!
             # DO IT YOURSELF!!
             self.multiwrite = self.dev.multiwrite
-            self.dev.reset()
-            self._setUpperBits(0)
+            # NOTE: THERE IS NO UPPER ADDRESS HANDLING IN QUEUED!
+            # DO IT YOURSELF!!
+            self.queued = self.dev.queued
+            if attach:
+                # just pick up wherever the upper bits are
+                self.upperBits = self.dev.read(self.map['BMDBGCTRL']) & self.dbgUpperMask
+            else:
+                self.dev.reset()
+                self._setUpperBits(0)
             
         elif type == self.AccessType.TURFGTP:
             turf = accessInfo[0]
@@ -140,33 +149,46 @@ class PueoTURFIO:
             # low 2 bits are up
             if linkstat & 0x3 != 0x3:
                 raise Exception("GTP link %d is not up" % ionum)
-            # configure bridge
-            brctl = bf(turf.read(turf.map['BRIDGECTRL']))
-            brctl[8*(ionum+1)-1:8*ionum] = 1
-            turf.write(turf.map['BRIDGECTRL'], int(brctl))
-            print("Bridge is: %8.8x" % turf.read(turf.map['BRIDGECTRL']))
-            # reset bridge status
-            turf.write(turf.map['BRIDGESTAT'], 0)
+            if not attach:
+                # configure bridge
+                brctl = bf(turf.read(turf.map['BRIDGECTRL']))
+                brctl[8*(ionum+1)-1:8*ionum] = 1
+                turf.write(turf.map['BRIDGECTRL'], int(brctl))
+                print("Bridge is: %8.8x" % turf.read(turf.map['BRIDGECTRL']))
+                # reset bridge status
+                turf.write(turf.map['BRIDGESTAT'], 0)
 
             self.dev = turf.crate.link[ionum]            
-            self.read = self.dev.read
-            self.write = self.dev.write
+            self.devpath = None if turf.devpath is None else f'{turf.devpath}/link{ionum}'
+            # we're just a window onto the TURF's transport, so let our
+            # submodules (and us) go straight there
+            self._resolve = self.dev._resolve
+            self.addrspace = self.dev.addrspace
+            root, offset = self._resolve()
+            self.read = lambda addr : root.read(addr + offset)
+            self.write = lambda addr, value : root.write(addr + offset, value)
+            self.readmany = self.dev.readmany
+            self.writemany = self.dev.writemany
+            self.readblock = self.dev.readblock
+            self.writeblock = self.dev.writeblock
             # not implemented now
             self.multiwrite = None
+            self.queued = None
             self.writeto = self.dev.writeto
-            # Test the bridge. Issue a read.
-            id = self.read(0)
-            # Now check to see if the read completed.
-            st = turf.read(turf.map['BRIDGESTAT'])
-            if st != 0:
-                raise Exception("TURFIO bridge error: %8.8x" % st)
+            # Test the bridge. Issue a read. (When attaching we never
+            # cleared the status, so it can't tell us anything.)
+            if not attach:
+                id = self.read(0)
+                # Now check to see if the read completed.
+                st = turf.read(turf.map['BRIDGESTAT'])
+                if st != 0:
+                    raise Exception("TURFIO bridge error: %8.8x" % st)
         elif type == self.AccessType.HSK:
             raise Exception("HSK connection is a Work In Progress")
         else:
             raise Exception("type must be one of",
                             [e.value for e in self.AccessType])
 
-        self.genshift = GenShift(self, 0x1000)
         self.SHIFT_JTAG_DEV = 0
         self.SHIFT_LMK_DEV = 1
         self.SHIFT_SPI_DEV = 2
@@ -176,42 +198,71 @@ class PueoTURFIO:
         self.SHIFT_LMKOE_GPIO = 3
         self.SHIFT_SPICSB_GPIO = 4
 
-        self.i2c = PueoTURFIOI2C(self.genshift)
-
-        self.genspi = GenSPI(self.genshift,
-                             self.SHIFT_SPI_DEV,
-                             self.SHIFT_SPICSB_GPIO,
-                             prescale=2)
-        
-        # set up the HSAligns.
-        self.cinalign = PueoCINAlign(self, self.map['SURFTURF'])
-        self.dalign = []
-        self.calign = []
-        for i in range(7):
-            self.calign.append(PueoCOUTAlign(self, self.map['SURFTURF']+0x40+0x40*i))
-            self.dalign.append(PueoDOUTAlign(self, self.map['SURFDOUT']+0x40*i))
-
-        # now the SURFbridges
-        self.surfbridge = []
-        for i in range(7):
-            self.surfbridge.append(SURFBridge(self,
-                                              self.map['SURFBRIDGE']+0x400000*i))        
-        # and common
-        self.surfturf = SURFTURF(self, self.map['SURFTURFCOMMON'])
-
-        # just generate the hski2c space
-        self.hski2c = dev_submod(self, 0x3000)
-        
-        # just generate the Aurora space
-        self.aurora = dev_submod(self, 0x4000)
-            
         # Clock monitor calibration value is now just
         # straight frequency thanks to silly DSP tricks.
         self.clockMonValue = 80000000
-        self.write(self.map['SYSCLKMON'], self.clockMonValue)
-        time.sleep(0.1)
-        # Set up the LMK interface as permanently driven.
-        self.genshift.setup(disableTris=(1<<self.SHIFT_LMK_DEV))
+        if not attach:
+            self.write(self.map['SYSCLKMON'], self.clockMonValue)
+            time.sleep(0.1)
+            # Set up the LMK interface as permanently driven.
+            self.genshift.setup(disableTris=(1<<self.SHIFT_LMK_DEV))
+
+    # The submodules only get built the first time they're used.
+    @cached_property
+    def genshift(self):
+        from ..common.genshift import GenShift
+        return GenShift(self, 0x1000)
+
+    @cached_property
+    def i2c(self):
+        from .turfio_i2c_bb import PueoTURFIOI2C
+        return PueoTURFIOI2C(self.genshift)
+
+    @cached_property
+    def genspi(self):
+        from ..common.genspi import GenSPI
+        return GenSPI(self.genshift,
+                      self.SHIFT_SPI_DEV,
+                      self.SHIFT_SPICSB_GPIO,
+                      prescale=2)
+
+    # the HSAligns.
+    @cached_property
+    def cinalign(self):
+        from .pueo_cinalign import PueoCINAlign
+        return PueoCINAlign(self, self.map['SURFTURF'])
+
+    @cached_property
+    def calign(self):
+        from .pueo_coutalign import PueoCOUTAlign
+        return [ PueoCOUTAlign(self, self.map['SURFTURF']+0x40+0x40*i) for i in range(7) ]
+
+    @cached_property
+    def dalign(self):
+        from .pueo_doutalign import PueoDOUTAlign
+        return [ PueoDOUTAlign(self, self.map['SURFDOUT']+0x40*i) for i in range(7) ]
+
+    # the SURFbridges
+    @cached_property
+    def surfbridge(self):
+        from .surfbridge import SURFBridge
+        return [ SURFBridge(self, self.map['SURFBRIDGE']+0x400000*i) for i in range(7) ]
+
+    # and common
+    @cached_property
+    def surfturf(self):
+        from .surfturf import SURFTURF
+        return SURFTURF(self, self.map['SURFTURFCOMMON'])
+
+    # just generate the hski2c space
+    @cached_property
+    def hski2c(self):
+        return dev_submod(self, 0x3000)
+
+    # just generate the Aurora space
+    @cached_property
+    def aurora(self):
+        return dev_submod(self, 0x4000)
 
     # Private function for handling upper bits in debug mode.
     def _setUpperBits(self, upperAddr):
@@ -238,16 +289,70 @@ class PueoTURFIO:
         addr = self._handleUpperAddr(addr)
         return self.dev.write(addr, value)
 
+    # Debug batch functions. The serial link queues a whole batch at
+    # once, so split it into runs that share the same upper bits and
+    # switch the upper bits (at most) once per run.
+    def _dbgReadmany(self, addrs):
+        rv = []
+        for upper, run in itertools.groupby(addrs, lambda a : a & self.dbgUpperMask):
+            rv += self.dev.readmany([ self._handleUpperAddr(a) for a in run ])
+        return rv
+
+    def _dbgWritemany(self, addrs, values):
+        rv = 0
+        ops = zip(addrs, values)
+        for upper, run in itertools.groupby(ops, lambda op : op[0] & self.dbgUpperMask):
+            run = list(run)
+            rv += self.dev.writemany([ self._handleUpperAddr(op[0]) for op in run ],
+                                     [ op[1] for op in run ])
+        return rv
+
+    # Debug block functions. These can only go straight through if the
+    # block doesn't need the upper bits, otherwise we do them one by one.
+    def _dbgReadblock(self, base, n, stride=4):
+        if (base | (base + n*stride - 1)) & self.dbgUpperMask:
+            import numpy as np
+            return np.array(self.readmany(range(base, base+n*stride, stride)),
+                            dtype=np.uint32)
+        return self.dev.readblock(base, n, stride)
+
+    def _dbgWriteblock(self, base, data, stride=4):
+        if (base | (base + len(data)*stride - 1)) & self.dbgUpperMask:
+            return self.writemany(range(base, base+len(data)*stride, stride),
+                                  [ int(v) for v in data ])
+        return self.dev.writeblock(base, data, stride)
+
     # There is no dbgWriteto function.
 
-    def dna(self):
-        self.write(self.map['DNA'], 0x80000000)
-        dnaval=0
-        for i in range(57):
-            r = self.read(self.map['DNA'])
-            val = r & 0x1
-            dnaval = (dnaval << 1) | val
-        return dnaval
+    def transaction(self):
+        """ Queue and merge writes until the with block exits (see dev_submod.transaction) """
+        return transaction(self)
+
+    def snapshot(self, fields=None, record=False):
+        """ Read all (or the named) register fields at once (see dev_submod.snapshot) """
+        return snapshot(self, fields, record)
+
+    def poll_until(self, addr, mask, value, timeout=1.0, strategy='backoff', name=None):
+        """ Wait for (read(addr) & mask) == value (see dev_submod.poll_until) """
+        return poll_until(self, addr, mask, value, timeout, strategy, name)
+
+    def eyescan_all(self, aligners=None, slptime=0.01, get_bitno=True, cntclks=131072):
+        """
+        Eye scan several aligners at once (default: the CIN and every
+        COUT and DOUT). Returns a list of scans, one per aligner, in the
+        same format as PueoHSAlign.eyescan (so process_eyescan_eyes works
+        on each one). Takes about as long as scanning one of them.
+        """
+        if aligners is None:
+            aligners = [ self.cinalign ] + self.calign + self.dalign
+        from .pueo_hsalign import PueoHSAlign
+        return PueoHSAlign.eyescan_all(aligners, slptime, get_bitno, cntclks)
+
+    def dna(self, refresh=False):
+        """ Device DNA, from the on-disk cache if we've seen this device/firmware before """
+        return pueo_utils.cached_dna(self, self.devpath,
+                                     self.read(self.map['FPGA_DATEVERSION']),
+                                     self.map['DNA'], refresh)
 
 
     def identify(self, verbose=True):
@@ -282,11 +387,9 @@ class PueoTURFIO:
         d['Local HSKBUS Override'] = rv[5]
         d['HSKBUS Crate Bridge Enable'] = rv[6]
         d['Housekeeping RX Byte Count'] = rv[23:16]
-        d['SYSCLK'] = self.read(self.map['SYSCLKMON'])
-        d['GTPCLK'] = self.read(self.map['GTPCLKMON'])
-        d['RXCLK'] = self.read(self.map['RXCLKMON'])
-        d['HSRXCLK'] = self.read(self.map['HSRXCLKMON'])
-        d['CLK200'] = self.read(self.map['CLK200MON'])
+        # clock monitors are contiguous from SYSCLKMON to CLK200MON
+        clks = [ 'SYSCLK', 'GTPCLK', 'RXCLK', 'HSRXCLK', 'CLK200' ]
+        d.update(zip(clks, self.readblock(self.map['SYSCLKMON'], len(clks)).tolist()))
         if verbose:
             for k in d.keys():
                 print(f'{k}: {d[k]}')
@@ -398,13 +501,12 @@ class PueoTURFIO:
         self.write(0xC, int(r))
 
     def enable_rxclk(self, on=True):
-        rv = bf(self.read(self.map['SURFTURFCOMMON']))
         if on is True:
             on = 0xFF
         if on is False:
             on = 0x0
-        rv[31:24] = (~on & 0xFF)
-        self.write(self.map['SURFTURFCOMMON'], int(rv))
+        # shadowed, so this is just a write after the first time
+        self.surfturf.rxclk_disable = (~on & 0xFF)
 
     # All of the eye alignment stuff is now in the HSAlign.
 
@@ -554,4 +656,5 @@ class PueoTURFIO:
     # only works if you have pyusb installed and are on Linux and have
     @classmethod
     def find_serial_devices(cls, board = -1, verbose=False):
+        from ..common.serialcobsdevice import SerialCOBSDevice
         return SerialCOBSDevice.find_serial_devices(board, 'TI', verbose)
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+# Per-operation cost of bitfield get/set: the bf object vs the
+# precompiled field helpers (and npfield on a whole array).
+
+from pueo.common.bf import bf, field, npfield
+import numpy as np
+import timeit
+
+N = 200000
+DATA_OUT = field(23, 16)
+NUM_BITS = field(26, 24)
+DATA_IN = field(7, 0)
+
+def bf_get(v=0x00AB0000):
+    return bf(v)[23:16]
+
+def field_get(v=0x00AB0000):
+    return DATA_OUT.get(v)
+
+def bf_rmw(v=0x12345678):
+    r = bf(v)
+    r[26:24] = 7
+    r[7:0] = 0x5A
+    return int(r)
+
+def field_rmw(v=0x12345678):
+    return DATA_IN.set(NUM_BITS.set(v, 7), 0x5A)
+
+def per_op(fn):
+    return min(timeit.repeat(fn, number=N, repeat=5))/N*1E9
+
+for name, fn in [ ('bf get', bf_get), ('field get', field_get),
+                  ('bf rmw', bf_rmw), ('field rmw', field_rmw) ]:
+    print(f'{name:<12} {per_op(fn):8.1f} ns/op')
+
+# numpy: a whole log of register values at once
+words = np.random.randint(0, 1<<32, size=1000000, dtype=np.uint64).astype(np.uint32)
+npf = npfield(23, 16)
+t = min(timeit.repeat(lambda : npf.get(words), number=10, repeat=5))/10
+print(f'{"npfield get":<12} {t/len(words)*1E9:8.2f} ns/word ({len(words)} words)')
+t = min(timeit.repeat(lambda : npf.set(words, 0x5A), number=10, repeat=5))/10
+print(f'{"npfield set":<12} {t/len(words)*1E9:8.2f} ns/word ({len(words)} words)')
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+# Checks how long the pueo packages take to import, using
+# python -X importtime in a fresh interpreter each time (best of
+# several runs), and fails if any of them go over budget.
+# Short-lived tools (cron jobs, housekeeping hooks) pay this every
+# time they run, so keep transports/numpy/etc. out of module level.
+
+import argparse
+import subprocess
+import sys
+
+# budgets in milliseconds
+BUDGET = { 'pueo.turf' : 50,
+           'pueo.turfio' : 50,
+           'pueo.surf' : 50 }
+
+def import_time(module):
+    """ cumulative import time of module, in ms """
+    r = subprocess.run([ sys.executable, '-X', 'importtime', '-c', 'import '+module ],
+                       capture_output=True, text=True, check=True)
+    for line in r.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1])/1000.
+    raise Exception("no importtime output for", module)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs", help="runs per module (best is kept)", type=int, default=5)
+parser.add_argument("--scale", help="multiply the budgets by this", type=float, default=1.0)
+args = parser.parse_args()
+
+failed = False
+for module, budget in BUDGET.items():
+    t = min(import_time(module) for i in range(args.runs))
+    budget = budget*args.scale
+    ok = t <= budget
+    print(f'{module:<12} {t:7.1f} ms (budget {budget:.0f} ms) {"OK" if ok else "OVER"}')
+    failed = failed or not ok
+
+sys.exit(1 if failed else 0)
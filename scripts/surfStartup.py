@@ -1,6 +1,7 @@
 from pueo.turf import PueoTURF
 from pueo.turfio import PueoTURFIO
 from pueo.surf import PueoSURF
+from pueo.common.aligncache import AlignCache
 import time
 import sys
 import argparse
@@ -8,12 +9,15 @@ from itertools import chain
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--enable")
+parser.add_argument("--cold", action='store_true',
+                    help="ignore cached alignments and scan everything")
 args = parser.parse_args()
 
 # WHATEVER JUST HARDCODE THIS FOR NOW
 surfList = [ (0, 0), (0, 5) ]
 
 dev = PueoTURF(None, 'Ethernet')
+cache = AlignCache(cold=args.cold)
 tio = {}
 masks = {}
 for surfAddr in surfList:
@@ -79,9 +83,36 @@ for i in range(4):
     surfEyes.append(stio)
 
 tioCompleteMask = [ 0, 0, 0, 0 ]
-    
-# Find ALL the eyes
+trainedSurfs = []
+
+# Cached eyes get applied and checked first, and they all have to
+# be the same eye (the scanned ones have to match it too).
+keys = {}
+for tn in tio:
+    board = cache.board(tio[tn])
+    for sn in range(7):
+        keys[(tn, sn)] = cache.key(board, 'dout', sn)
+
+warmEye = None
+def warm_dout(surfAddr, eye):
+    if warmEye is not None and eye[1] != warmEye:
+        return False
+    return tio[surfAddr[0]].dalign[surfAddr[1]].try_alignment(eye)
+
+rescan = []
+warmSurfs = []
 for surfAddr in surfActiveList:
+    tn = surfAddr[0]
+    sn = surfAddr[1]
+    if cache.warm([ keys[surfAddr] ], lambda n, eye : warm_dout(surfAddr, eye)):
+        rescan.append(surfAddr)
+    else:
+        print(f'DOUT on SURF#{sn} on TURFIO#{tn} using cached alignment {cache.get(keys[surfAddr])}')
+        warmEye = cache.get(keys[surfAddr])[1]
+        tioCompleteMask[tn] |= (1<<sn)
+        warmSurfs.append(surfAddr)
+
+def scan_dout(surfAddr):
     tn = surfAddr[0]
     sn = surfAddr[1]
     t = tio[tn]
@@ -90,20 +121,24 @@ for surfAddr in surfActiveList:
         eyes = t.dalign[sn].find_alignment(do_reset=True, verbose=True)
     except IOError:
         print(f'DOUT alignment failed on SURF#{sn} on TURFIO#{tn}, skipping')
-        continue
+        tioCompleteMask[tn] &= ~(1<<sn)
+        return
     print(f'DOUT alignment found eyes: {eyes}')
     surfEyes[tn][sn] = eyes
     tioCompleteMask[tn] |= (1<<sn)
 
-print('Eyes found, processing to find a common one.')
-commonEye = None
-for d in list(chain(*surfEyes)):
-    if d is not None:
-        commonEye = d.keys() if commonEye is None else commonEye & d.keys()
-
-print(f'Common eye[s]: {commonEye}')
-usingEye = None
-if len(commonEye) > 1:
+def choose_eye(warmEye):
+    print('Eyes found, processing to find a common one.')
+    commonEye = None if warmEye is None else { warmEye }
+    for d in list(chain(*surfEyes)):
+        if d is not None:
+            commonEye = d.keys() if commonEye is None else commonEye & d.keys()
+
+    print(f'Common eye[s]: {commonEye}')
+    if commonEye is None or len(commonEye) == 0:
+        return None
+    if len(commonEye) == 1:
+        return list(commonEye)[0]
     print(f'Multiple common eyes found, choosing the one with smallest delay')
     test_surf = None
     for i in range(4):
@@ -122,11 +157,29 @@ if len(commonEye) > 1:
                 min = test_surf[eye]
                 minEye = eye
                 print(f'New eye {minEye} has smaller tap {min}, using it')
-    usingEye = minEye
-elif len(commonEye):
-    usingEye = list(commonEye)[0]
+    return minEye
 
-trainedSurfs = []
+# Find ALL the eyes
+for surfAddr in rescan:
+    scan_dout(surfAddr)
+
+usingEye = choose_eye(warmEye)
+# The scanned SURFs don't have the eye the cached ones are using:
+# forget the cached ones and scan everybody.
+if usingEye is None and len(warmSurfs):
+    print(f'Scanned SURFs cannot use cached eye {warmEye}, rescanning all')
+    cache.invalidate([ keys[surfAddr] for surfAddr in warmSurfs ])
+    for surfAddr in warmSurfs:
+        scan_dout(surfAddr)
+    warmEye = None
+    warmSurfs = []
+    usingEye = choose_eye(warmEye)
+
+if usingEye is None and any(d is not None for d in chain(*surfEyes)):
+    print("No common eye found???!?")
+    sys.exit(1)
+
+trainedSurfs.extend(warmSurfs)
 
 for i in range(4):
     for j in range(7):
@@ -134,6 +187,10 @@ for i in range(4):
             eye = (surfEyes[i][j][usingEye], usingEye)
             tio[i].dalign[j].apply_alignment(eye)
             trainedSurfs.append( (i, j) )
+            cache.put(keys[(i, j)], eye)
+
+cache.save()
+print(f'{cache.nwarm} alignments from cache, {cache.nscan} scanned')
 
 # Enabling is a bit tricky, because we CANNOT
 # enable the data path UNTIL the SURF exits
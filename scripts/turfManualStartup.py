@@ -5,6 +5,7 @@
 
 from pueo.turf import PueoTURF
 from pueo.turfio import PueoTURFIO
+from pueo.common.aligncache import AlignCache
 
 import argparse
 import sys
@@ -12,6 +13,8 @@ import sys
 parser = argparse.ArgumentParser()
 parser.add_argument("--turfio", type=str, default="0,1,2,3",
                     help="comma-separated list of TURFIOs to initialize")
+parser.add_argument("--cold", action='store_true',
+                    help="ignore cached alignments and scan everything")
 
 args = parser.parse_args()
 validTios = [0,1,2,3]
@@ -22,8 +25,10 @@ for tio in tioList:
         sys.exit(1)
 
 dev = PueoTURF(None, 'Ethernet')
+cache = AlignCache(cold=args.cold)
 
 tios = [ None, None, None, None ]
+keys = [ None, None, None, None ]
 for tionum in tioList:
     print(f'Trying to initialize TURFIO#{tionum}')
     if not (dev.aurora.linkstat(tionum) & 0x1):
@@ -33,32 +38,66 @@ for tionum in tioList:
     tio.program_sysclk(tio.ClockSource.TURF)
     while not ((tio.read(0xC) & 0x1)):
         print(f'Waiting for clock on TURFIO#{tionum}...')
-    print(f'Aligning RXCLK->SYSCLK transition on TURFIO#{tionum}...')
-    tap = tio.cinalign.align_rxclk()
+    board = cache.board(tio)
+    keys[tionum] = cache.key(board, 'cin')
+    rxkey = cache.key(board, 'rxclk')
+    if cache.warm([ rxkey ], lambda n, tap : tio.cinalign.try_rxclk(tap)):
+        print(f'Aligning RXCLK->SYSCLK transition on TURFIO#{tionum}...')
+        tio.cinalign.align_rxclk()
+        cache.put(rxkey, tio.cinalign.rxclk_phase)
+    tap = cache.get(rxkey)
     print(f'TURFIO#{tionum} - tap is {tap}')
     print(f'Aligning CIN on TURFIO#{tionum}...')    
     dev.ctl.tio[tionum].train_enable(True)
     tios[tionum] = tio
 
-tioEyes = [ None, None, None, None ]
+# Cached CIN eyes are applied and checked first: only the TURFIOs
+# that fail get scanned, and they have to use the same eye.
+def warm_cin(tio, eye):
+    if warmEye is not None and eye[1] != warmEye:
+        return False
+    if not tio.cinalign.try_alignment(eye):
+        return False
+    try:
+        tio.cinalign.enable(True)
+    except Exception:
+        return False
+    return True
+
+warmEye = None
+warmTios = []
 for i in range(4):
     if tios[i] is not None:
-        try:
-            eyes = tios[i].cinalign.find_alignment(do_reset=True)        
-        except IOError:
-            print(f'Alignment failed on TURFIO#{i}, skipping')
-            continue
-        print(f'CIN alignment found eyes: {eyes}')
-        tioEyes[i] = eyes
-
-print("Eyes found, processing to find a common one:")
-commonEye = None
-for d in tioEyes:
-    if d is not None:
-        commonEye = d.keys() if commonEye is None else commonEye & d.keys() 
-print(f'Common eye[s]: {commonEye}')
-usingEye = None
-if len(commonEye) > 1:
+        if not cache.warm([ keys[i] ], lambda n, eye : warm_cin(tios[i], eye)):
+            print(f'CIN on TURFIO#{i} using cached alignment {cache.get(keys[i])}')
+            warmEye = cache.get(keys[i])[1]
+            warmTios.append(i)
+
+def scan_cin(i):
+    try:
+        eyes = tios[i].cinalign.find_alignment(do_reset=True)        
+    except IOError:
+        print(f'Alignment failed on TURFIO#{i}, skipping')
+        return None
+    print(f'CIN alignment found eyes: {eyes}')
+    return eyes
+
+tioEyes = [ None, None, None, None ]
+for i in range(4):
+    if tios[i] is not None and i not in warmTios:
+        tioEyes[i] = scan_cin(i)
+
+def choose_eye(tioEyes, warmEye):
+    print("Eyes found, processing to find a common one:")
+    commonEye = None if warmEye is None else { warmEye }
+    for d in tioEyes:
+        if d is not None:
+            commonEye = d.keys() if commonEye is None else commonEye & d.keys() 
+    print(f'Common eye[s]: {commonEye}')
+    if commonEye is None or len(commonEye) == 0:
+        return None
+    if len(commonEye) == 1:
+        return list(commonEye)[0]
     print(f'Multiple common eyes found, choosing the one with smallest delay')
     test_turfio = None
     for i in range(4):
@@ -77,9 +116,19 @@ if len(commonEye) > 1:
                 min = test_turfio[eye]
                 minEye = eye
                 print(f'New eye {minEye} has smaller tap {min}, using it')
-    usingEye = minEye
-elif len(commonEye):
-    usingEye = list(commonEye)[0]
+    return minEye
+
+usingEye = choose_eye(tioEyes, warmEye)
+# The scanned TURFIOs don't have the eye the cached ones are using:
+# forget the cached ones and scan everybody.
+if usingEye is None and len(warmTios):
+    print(f'Scanned TURFIOs cannot use cached eye {warmEye}, rescanning all')
+    cache.invalidate([ keys[i] for i in warmTios ])
+    for i in warmTios:
+        tioEyes[i] = scan_cin(i)
+    warmEye = None
+    warmTios = []
+    usingEye = choose_eye(tioEyes, warmEye)
 
 if usingEye is None:
     print("No common eye found???!?")
@@ -88,6 +137,10 @@ if usingEye is None:
 print(f'Using eye: {usingEye}')
 
 aligned_turfios = []
+for i in warmTios:
+    dev.ctl.tio[i].train_enable(False)
+    aligned_turfios.append(tios[i])
+
 for i in range(4):
     if tioEyes[i] is not None:
         eye = (tioEyes[i][usingEye], usingEye)
@@ -108,6 +161,10 @@ for i in range(4):
         else:
             print(f'CIN aligned and running on TURFIO#{i} after {trials} attempts')
             aligned_turfios.append(tios[i])
+            cache.put(keys[i], eye)
+
+cache.save()
+print(f'{cache.nwarm} alignments from cache, {cache.nscan} scanned')
             
 
 for tio in aligned_turfios:    